@@ -0,0 +1,491 @@
+import asyncio
+import json
+import mimetypes
+import mmap
+import os
+import ssl
+import threading
+import time
+from concurrent.futures import Future, wait
+from urllib.parse import urlencode, urlsplit
+
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+
+from upload_metrics import metrics
+from youtube_uploader import (CHUNK_SIZE_MAX, CHUNK_SIZE_MIN, QUOTA_COSTS, ChunkSizer, CircuitBreaker,
+                              PlaylistItemQueue, QuotaExceededError, RetryPolicy, UploadStats, _token_lock,
+                              check_file_size, error_name, fingerprint_files, is_quota_error, record_upload,
+                              refresh_credentials)
+
+# An upload engine that runs every upload as a coroutine on one event loop,
+# speaking the resumable upload protocol over a small pool of keep-alive
+# HTTP/1.1 connections instead of one blocking httplib2 client per upload.
+# AsyncUploadPool has the same submit/cancel/shutdown interface as
+# UploadWorkerPool, so process_directory can use either.
+
+# Request bodies are written in blocks of this size, so the transport never copies a whole chunk
+WRITE_BLOCK = 1024 * 1024
+# Give up on a request that hasn't completed in this many seconds
+REQUEST_TIMEOUT = 600
+
+class HttpClient:
+    # A minimal HTTP/1.1 client on asyncio streams that keeps connections
+    # open and reuses them, at most `connections` per host.
+    def __init__(self, connections=8):
+        self.connections = connections
+        self._idle = {}        # (scheme, host, port) -> [(reader, writer)]
+        self._semaphores = {}  # (scheme, host, port) -> asyncio.Semaphore
+        self._ssl = ssl.create_default_context()
+
+    async def request(self, method, url, headers=None, body=b''):
+        # Returns (status, headers, body) with lower-case header names
+        url = urlsplit(url)
+        key = (url.scheme, url.hostname, url.port or (443 if url.scheme == 'https' else 80))
+        target = url.path + (f'?{url.query}' if url.query else '')
+        semaphore = self._semaphores.setdefault(key, asyncio.Semaphore(self.connections))
+        async with semaphore:
+            reused = bool(self._idle.get(key))
+            reader, writer = await self._connect(key)
+            try:
+                status, response_headers, content = await asyncio.wait_for(
+                    self._exchange(reader, writer, method, key, target, headers or {}, body), REQUEST_TIMEOUT)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if not reused:
+                    raise
+                # The server closed the idle connection; once more on a new one
+                reader, writer = await self._connect(key, fresh=True)
+                try:
+                    status, response_headers, content = await asyncio.wait_for(
+                        self._exchange(reader, writer, method, key, target, headers or {}, body), REQUEST_TIMEOUT)
+                except BaseException:
+                    writer.close()
+                    raise
+            except BaseException:
+                writer.close()
+                raise
+            if response_headers.get('connection', '').lower() == 'close':
+                writer.close()
+            else:
+                self._idle.setdefault(key, []).append((reader, writer))
+            return status, response_headers, content
+
+    async def _connect(self, key, fresh=False):
+        idle = self._idle.get(key)
+        while idle and not fresh:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        scheme, host, port = key
+        return await asyncio.open_connection(host, port, ssl=self._ssl if scheme == 'https' else None)
+
+    async def _exchange(self, reader, writer, method, key, target, headers, body):
+        host = key[1] if key[2] in (80, 443) else f'{key[1]}:{key[2]}'
+        lines = [f'{method} {target} HTTP/1.1', f'Host: {host}', f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        body = memoryview(body)
+        for start in range(0, len(body), WRITE_BLOCK):
+            writer.write(body[start:start + WRITE_BLOCK])
+            await writer.drain()
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed before a response')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            content = b''
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            content = b''
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                content += await reader.readexactly(size)
+                await reader.readexactly(2)
+        elif 'content-length' in response_headers:
+            content = await reader.readexactly(int(response_headers['content-length']))
+        else:
+            content = await reader.read()
+            response_headers['connection'] = 'close'
+        return status, response_headers, content
+
+    async def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle = {}
+
+def _http_error(status, headers, content, url):
+    # The same exception the googleapiclient engine raises, so callers handle both alike
+    return HttpError(Response({'status': status, **headers}), content, uri=url)
+
+class AsyncUploadPool:
+    def __init__(self, storage, workers=16, root_url='https://youtube.googleapis.com/', credentials=None,
+                 update_file_progress=None, gate=None, dedupe='link', full_hash=False, quota=None,
+                 bandwidth=None, chunk_sizes=(CHUNK_SIZE_MIN, CHUNK_SIZE_MAX), connections=None, youtube=None,
+                 batch_playlists=True):
+        self.storage = storage
+        self.workers = max(1, workers)
+        self.root_url = root_url.rstrip('/') + '/'
+        self.credentials = credentials
+        self.update_file_progress = update_file_progress
+        self.gate = gate
+        self.dedupe = dedupe
+        self.full_hash = full_hash
+        self.quota = quota
+        self.bandwidth = bandwidth
+        self.chunk_sizes = chunk_sizes
+        self.stats = {}  # file_path -> UploadStats of uploads started by this pool
+        # Playlist attachments go out in batches through the googleapiclient service, as with UploadWorkerPool
+        self.youtube = youtube
+        self.playlist_queue = PlaylistItemQueue(storage, quota) if batch_playlists and youtube is not None else None
+        self.retry_policy = RetryPolicy(breaker=CircuitBreaker())
+        self.stop_event = threading.Event()
+        self.client = HttpClient(connections or self.workers)
+        self._attached = {}  # playlist_id -> Future set once the last submitted video is in the playlist
+        self._futures = set()
+        self._slots = None
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='async-uploader', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_service(cls, youtube, storage, **kwargs):
+        # Same endpoint and credentials as a googleapiclient service
+        credentials = youtube._http.credentials if isinstance(youtube._http, AuthorizedHttp) else None
+        return cls(storage, root_url=youtube._rootDesc['rootUrl'], credentials=credentials, youtube=youtube, **kwargs)
+
+    def submit(self, file_path, playlist_id):
+        # Videos join their playlist in the order they were submitted, as with UploadWorkerPool
+        previous = self._attached.get(playlist_id)
+        attached = self._attached[playlist_id] = Future()
+        future = asyncio.run_coroutine_threadsafe(self._upload(file_path, playlist_id, previous, attached), self.loop)
+        self._futures.add(future)
+        return future
+
+    def cancel(self):
+        self.stop_event.set()
+        if self.quota:
+            self.quota.stop()
+        if self.bandwidth:
+            self.bandwidth.stop()
+        self.retry_policy.stop()
+        for future in self._futures:
+            future.cancel()
+
+    def flush_playlists(self):
+        # Send queued playlist attachments now instead of waiting for a full batch.
+        # Returns False if the quota ran out; the rest stay pending.
+        if self.playlist_queue is not None and len(self.playlist_queue):
+            return self.playlist_queue.flush(self.youtube, final=True)
+        return True
+
+    def shutdown(self):
+        wait(self._futures)
+        # Whatever is left goes out now; anything the quota won't allow stays pending for the next run
+        if not self.flush_playlists():
+            print(f"{len(self.playlist_queue)} videos are still waiting to be added to playlists.")
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    async def _upload(self, file_path, playlist_id, previous, attached):
+        try:
+            if self._slots is None:
+                self._slots = asyncio.Semaphore(self.workers)
+            while True:
+                try:
+                    async with self._slots:
+                        if self.stop_event.is_set() or (self.gate and not await asyncio.to_thread(self.gate)):
+                            return None, None, None
+                        if self.credentials is not None:
+                            await asyncio.to_thread(refresh_credentials, self.credentials)
+                        video = await self._prepare(file_path, playlist_id)
+                    break
+                except QuotaExceededError:
+                    # Tried again once the next reservation has waited for the reset; the
+                    # stored session lets the upload continue where it stopped
+                    if not await asyncio.to_thread(self._quota_refused):
+                        raise
+            if video is None:
+                return None, None, None
+            video_id, video_title, needs_playlist = video
+            if needs_playlist:
+                # Wait until the video submitted before this one is in the playlist, or queued for it
+                if previous is not None:
+                    await asyncio.wrap_future(previous)
+                if self.playlist_queue is not None:
+                    await asyncio.to_thread(self.playlist_queue.put, playlist_id, video_id, video_title, file_path)
+                    # The googleapiclient service is only used by one thread at a time, under the flush lock
+                    await asyncio.to_thread(self.playlist_queue.flush, self.youtube)
+                else:
+                    while True:
+                        try:
+                            await self._add_to_playlist(playlist_id, video_id)
+                            break
+                        except QuotaExceededError:
+                            if not await asyncio.to_thread(self._quota_refused):
+                                raise
+                            await asyncio.to_thread(self.quota.reserve, QUOTA_COSTS['playlistItems.insert'],
+                                                    f"adding {file_path} to a playlist")
+                    await asyncio.to_thread(self.storage.add_video, video_id, video_title, playlist_id, file_path,
+                                            'uploaded')
+            return video_id, video_title, playlist_id
+        except Exception as e:
+            metrics.inc('youtube_uploader_uploads_total', outcome='failed')
+            metrics.event('failed', file=file_path, error=repr(e))
+            raise
+        finally:
+            attached.set_result(None)
+
+    def _quota_refused(self):
+        # The API refused a call for quota, as UploadWorkerPool handles it: True if the
+        # call should be made again after the reset, which the next reservation waits for
+        if not self.quota or not self.quota.wait_for_reset or self.quota.stop_event.is_set():
+            return False
+        # Something else used up the project's quota
+        self.quota.exhaust()
+        return True
+
+    async def _prepare(self, file_path, playlist_id):
+        # Returns (video_id, video_title, needs_playlist), or None when stopped.
+        # Storage is only called from threads: a SQLite write waits for the writer
+        # thread's next commit, which would hold up every upload on the loop.
+        stored_video = await asyncio.to_thread(self.storage.get_video, file_path)
+        if stored_video:
+            print(f"Video {os.path.basename(file_path)} already uploaded. Skipping.")
+            metrics.inc('youtube_uploader_uploads_total', outcome='skipped')
+            return stored_video[0], stored_video[1], False
+
+        if self.dedupe != 'off':
+            fingerprints = await asyncio.to_thread(fingerprint_files, [file_path], self.storage, self.full_hash)
+            size, _, sample_hash, file_hash = fingerprints[file_path]
+            duplicate = await asyncio.to_thread(self.storage.find_video_by_fingerprint, size, sample_hash, file_hash)
+            if duplicate:
+                video_id, video_title, duplicate_playlist_id = duplicate[0], duplicate[1], duplicate[2]
+                print(f"Video {os.path.basename(file_path)} is a copy of {duplicate[3]}, already uploaded as {video_id}.")
+                metrics.inc('youtube_uploader_uploads_total', outcome='duplicate')
+                if self.dedupe == 'link' and duplicate_playlist_id != playlist_id:
+                    if self.quota:
+                        await asyncio.to_thread(self.quota.reserve, QUOTA_COSTS['playlistItems.insert'],
+                                                f"adding {file_path} to a playlist")
+                    return video_id, video_title, True
+                await asyncio.to_thread(self.storage.add_video, video_id, video_title, duplicate_playlist_id,
+                                        file_path, 'uploaded')
+                return video_id, video_title, False
+
+        if self.quota:
+            # Only start an upload when today's budget also covers adding it to the playlist
+            await asyncio.to_thread(self.quota.reserve, QUOTA_COSTS['videos.insert'] +
+                                    QUOTA_COSTS['playlistItems.insert'], f"uploading {file_path}")
+        response = await self._transfer(file_path, playlist_id)
+        if response is None:
+            return None
+        return response['id'], response['snippet']['title'], True
+
+    async def _headers(self, headers):
+        if self.credentials is not None:
+            if not self.credentials.valid:
+                await asyncio.to_thread(self._refresh_credentials)
+            headers['Authorization'] = f'Bearer {self.credentials.token}'
+        return headers
+
+    def _refresh_credentials(self):
+        from google.auth.transport.requests import Request
+
+        with _token_lock:
+            if not self.credentials.valid:
+                self.credentials.refresh(Request())
+
+    async def _call(self, api_method, method, url, headers, body=b''):
+        # One API call, retried per the retry policy; non-retryable errors are raised as HttpError
+        attempt = 0
+        while True:
+            try:
+                metrics.inc('youtube_uploader_api_calls_total', method=api_method)
+                status, response_headers, content = await self.client.request(
+                    method, url, await self._headers(dict(headers)), body)
+                if status >= 400:
+                    raise _http_error(status, response_headers, content, url)
+                self.retry_policy.succeeded()
+                return status, response_headers, content
+            except Exception as e:
+                attempt = await self._backoff(e, attempt, url)
+
+    async def _backoff(self, error, attempt, description):
+        if isinstance(error, HttpError) and is_quota_error(error):
+            raise QuotaExceededError("YouTube API quota has been exceeded. Please try again later.")
+        if not self.retry_policy.is_retryable(error) or attempt + 1 >= self.retry_policy.max_attempts:
+            raise error
+        attempt += 1
+        metrics.inc('youtube_uploader_retries_total', error=error_name(error))
+        delay = self.retry_policy.failed(attempt)
+        print(f"{description}: {error!r}; retrying in {delay:.1f} s "
+              f"(attempt {attempt} of {self.retry_policy.max_attempts - 1})")
+        await asyncio.sleep(delay)
+        if not await asyncio.to_thread(self.retry_policy.wait):
+            raise asyncio.CancelledError()
+        return attempt
+
+    async def _add_to_playlist(self, playlist_id, video_id):
+        body = {
+            "snippet": {
+                "playlistId": playlist_id,
+                "resourceId": {
+                    "kind": "youtube#video",
+                    "videoId": video_id
+                }
+            }
+        }
+        await self._call('youtube.playlistItems.insert', 'POST',
+                         f"{self.root_url}youtube/v3/playlistItems?part=snippet",
+                         {'Content-Type': 'application/json; charset=UTF-8'}, json.dumps(body).encode())
+
+    async def _start_session(self, file_path, size, mimetype):
+        video_title = os.path.splitext(os.path.basename(file_path))[0]
+        body = {
+            'snippet': {
+                'title': video_title,
+                'description': 'Uploaded using bulk uploader script',
+                "tags": ["bulk", "uploader", "youtube"],
+                "categoryId": "22",
+            },
+            'status': {
+                'privacyStatus': 'unlisted',
+            }
+        }
+        query = urlencode({'uploadType': 'resumable', 'part': 'snippet,status'})
+        _, headers, _ = await self._call('youtube.videos.insert', 'POST',
+                                         f"{self.root_url}upload/youtube/v3/videos?{query}", {
+            'Content-Type': 'application/json; charset=UTF-8',
+            'X-Upload-Content-Length': str(size),
+            'X-Upload-Content-Type': mimetype,
+        }, json.dumps(body).encode())
+        return headers['location']
+
+    async def _query_session(self, session_uri, size):
+        # An empty PUT asks the server how much of the session it has committed.
+        # Returns (offset, None) or (size, video resource) once the upload is complete.
+        metrics.inc('youtube_uploader_api_calls_total', method='youtube.videos.insert')
+        status, headers, content = await self.client.request(
+            'PUT', session_uri, await self._headers({'Content-Range': f'bytes */{size}'}))
+        if status in (200, 201):
+            return size, json.loads(content)
+        if status != 308:
+            raise _http_error(status, headers, content, session_uri)
+        return (int(headers['range'].split('-')[1]) + 1 if 'range' in headers else 0), None
+
+    async def _transfer(self, file_path, playlist_id):
+        # Sends the file, resuming a session stored by an earlier run. Returns the video resource.
+        file_stat = os.stat(file_path)
+        size = file_stat.st_size
+        mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        stats = self.stats.setdefault(file_path, UploadStats(file_path, size))
+        sizer = ChunkSizer(*self.chunk_sizes)
+
+        session_uri, offset = None, 0
+        session = await asyncio.to_thread(self.storage.get_upload_session, file_path)
+        if session:
+            stored_uri, _, stored_size, stored_mtime = session
+            if stored_size == size and stored_mtime == file_stat.st_mtime:
+                try:
+                    offset, response = await self._query_session(stored_uri, size)
+                    if response is not None:
+                        return response
+                    session_uri = stored_uri
+                    print(f"Resuming {os.path.basename(file_path)} from byte {offset} of {size}")
+                except HttpError:
+                    pass  # Expired; start over with a new session
+            if session_uri is None:
+                await asyncio.to_thread(self.storage.delete_upload_session, file_path)
+        if session_uri is None:
+            session_uri = await self._start_session(file_path, size, mimetype)
+
+        with open(file_path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+            view = memoryview(mapped) if mapped else memoryview(b'')
+            try:
+                attempt = 0  # Failures in a row; reset by every chunk that gets through
+                resync = False
+                while True:
+                    if self.stop_event.is_set():
+                        return None
+                    try:
+                        if resync:
+                            offset, response = await self._query_session(session_uri, size)
+                            if response is not None:
+                                break
+                            resync = False
+                        chunk_size = sizer.size
+                        if self.bandwidth and self.bandwidth.chunk_size():
+                            chunk_size = min(chunk_size, self.bandwidth.chunk_size())
+                        end = min(offset + chunk_size, size)
+                        if self.bandwidth and not await asyncio.to_thread(self.bandwidth.acquire, end - offset):
+                            return None
+
+                        check_file_size(f, size, file_path)
+                        # An empty file is finished with an empty request
+                        content_range = f'bytes {offset}-{end - 1}/{size}' if end > offset else f'bytes */{size}'
+                        started = time.monotonic()
+                        metrics.inc('youtube_uploader_api_calls_total', method='youtube.videos.insert')
+                        status, headers, content = await self.client.request(
+                            'PUT', session_uri, await self._headers({
+                                'Content-Range': content_range,
+                                'Content-Type': mimetype,
+                            }), view[offset:end])
+                        seconds = time.monotonic() - started
+                        if status in (200, 201):
+                            stats.record(chunk_size, end - offset, seconds)
+                            metrics.sent(end - offset, seconds)
+                            response = json.loads(content)
+                            break
+                        if status != 308:
+                            raise _http_error(status, headers, content, session_uri)
+                        self.retry_policy.succeeded()
+                        attempt = 0
+                        sizer.record(end - offset, seconds)
+                        stats.record(chunk_size, end - offset, seconds)
+                        metrics.sent(end - offset, seconds)
+                        metrics.event('chunk', file=file_path, offset=offset, bytes=end - offset,
+                                      chunk_size=chunk_size, seconds=round(seconds, 4))
+                        offset = int(headers['range'].split('-')[1]) + 1 if 'range' in headers else 0
+                        await asyncio.to_thread(self.storage.save_upload_session, file_path, session_uri, offset,
+                                                size, file_stat.st_mtime)
+                        if self.update_file_progress:
+                            progress = int(offset / size * 100)
+                            remaining_time = stats.eta(size - offset)  # Seconds, -1 if unknown
+                            self.update_file_progress.emit(playlist_id, file_path, progress,
+                                                           -1 if remaining_time is None else remaining_time)
+                    except Exception as e:
+                        attempt = await self._backoff(e, attempt, os.path.basename(file_path))
+                        sizer.failed()
+                        stats.retries += 1
+                        resync = True
+            finally:
+                try:
+                    view.release()
+                    if mapped:
+                        mapped.close()
+                except BufferError:
+                    pass  # A failed request's traceback still holds a view; the map goes with the last one
+
+        stats.finish()
+        print(f"Uploaded {stats.summary()}")
+        record_upload(stats)
+        await asyncio.to_thread(self.storage.delete_upload_session, file_path)
+        return response
@@ -0,0 +1,264 @@
+import argparse
+import contextlib
+import csv
+import io
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from youtube_uploader import DataStorage
+
+# Benchmarks for the uploader. Run one with e.g. `python benchmarks.py csv-lookup`.
+
+# Started by the startup benchmark: the GUI up to its first turn of the event loop
+GUI_LAUNCH = """
+import sys
+from PyQt6.QtCore import QTimer
+from PyQt6.QtWidgets import QApplication
+import youtube_uploader_gui
+app = QApplication(sys.argv)
+window = youtube_uploader_gui.MainWindow()
+window.show()
+QTimer.singleShot(0, app.quit)
+app.exec()
+"""
+
+# End-to-end scenarios: (playlists, files per playlist, KiB per file)
+SCENARIOS = {
+    'small-files': (10, 100, 1024),
+    'huge-files': (1, 3, 2 * 1024 * 1024),
+    'many-playlists': (2000, 1, 64),
+}
+
+def _scan_csv(filename, file_path):
+    # How CSV lookups used to work: reopen the file and scan every row
+    with open(filename, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)  # Skip header
+        for row in reader:
+            if len(row) >= 5 and row[3] == file_path and row[4] != 'dry_run':
+                return row
+    return None
+
+def bench_csv_lookup(rows, lookups):
+    with tempfile.TemporaryDirectory() as workdir:
+        filename = os.path.join(workdir, 'videos.csv')
+        paths = [os.path.join('videos', f'playlist_{i // 50}', f'video_{i}.mp4') for i in range(rows)]
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['id', 'title', 'playlist_id', 'file_path', 'status'])
+            for i, path in enumerate(paths):
+                writer.writerow([f'video{i}', f'video_{i}', f'playlist{i // 50}', path, 'uploaded'])
+
+        start = time.perf_counter()
+        storage = DataStorage('csv', filename)
+        load_time = time.perf_counter() - start
+
+        sample = [random.choice(paths) for _ in range(lookups)]
+        start = time.perf_counter()
+        for path in sample:
+            assert storage.get_video(path) is not None
+        indexed_time = (time.perf_counter() - start) / lookups
+
+        scan_sample = sample[:max(1, min(lookups, 20))]
+        start = time.perf_counter()
+        for path in scan_sample:
+            assert _scan_csv(filename, path) is not None
+        scan_time = (time.perf_counter() - start) / len(scan_sample)
+
+    print(f"CSV storage with {rows:,} rows")
+    print(f"  load once:        {load_time * 1000:10.1f} ms")
+    print(f"  indexed lookup:   {indexed_time * 1e6:10.2f} us")
+    print(f"  full-scan lookup: {scan_time * 1e6:10.2f} us")
+    print(f"  full run, indexed vs scanned: {load_time + indexed_time * rows:.2f} s vs {scan_time * rows:.0f} s")
+
+def _upload_files(media_class, paths, chunk_size):
+    # Runs in a fresh process, so its peak RSS belongs to this media class alone
+    import resource
+
+    from fake_youtube_server import FakeYouTubeServer
+    from mapped_media import MappedMediaUpload
+
+    def upload(path):
+        youtube = server.build_service()
+        media = media_class(path, chunksize=chunk_size, resumable=True)
+        request = youtube.videos().insert(part="snippet", body={'snippet': {'title': os.path.basename(path)}},
+                                          media_body=media)
+        response = None
+        while response is None:
+            _, response = request.next_chunk()
+            if isinstance(media, MappedMediaUpload):
+                media.release()
+
+    with FakeYouTubeServer() as server:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+            list(executor.map(upload, paths))
+        seconds = time.perf_counter() - start
+    peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return seconds, peak_kib
+
+def bench_upload_memory(files, size_mib, chunk_mib):
+    from googleapiclient.http import MediaFileUpload
+
+    from mapped_media import MappedMediaUpload
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = []
+        for i in range(files):
+            path = os.path.join(workdir, f'video_{i}.mp4')
+            with open(path, 'wb') as f:
+                # Written out rather than sparse, so reads hit the page cache like a real file
+                block = os.urandom(1024 * 1024)
+                for _ in range(size_mib):
+                    f.write(block)
+            paths.append(path)
+
+        total_mib = files * size_mib
+        print(f"Uploading {files} x {size_mib:,} MiB concurrently to a local server, {chunk_mib} MiB chunks")
+        for name, media_class in (('MediaFileUpload', MediaFileUpload), ('MappedMediaUpload', MappedMediaUpload)):
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                seconds, peak_kib = executor.submit(_upload_files, media_class, paths,
+                                                    chunk_mib * 1024 * 1024).result()
+            print(f"  {name:18} {seconds:7.2f} s  {total_mib / seconds:8.1f} MiB/s  peak RSS {peak_kib / 1024:8.1f} MiB")
+
+def _make_library(root, playlists, files, size_kib):
+    # Every file repeats its own random block, so they are quick to write but all different
+    for p in range(playlists):
+        directory = os.path.join(root, f'playlist_{p:04d}')
+        os.makedirs(directory, exist_ok=True)
+        for i in range(files):
+            path = os.path.join(directory, f'video_{i:04d}.mp4')
+            if os.path.exists(path) and os.path.getsize(path) == size_kib * 1024:
+                continue
+            block = os.urandom(min(size_kib, 1024) * 1024)
+            with open(path, 'wb') as f:
+                for _ in range(size_kib * 1024 // len(block)):
+                    f.write(block)
+
+def _process_library(url, root, storage_file, storage_type, workers, engine):
+    # Runs in a fresh process, so its peak RSS is the uploader's alone
+    import resource
+
+    from fake_youtube_server import build_service
+    from youtube_uploader import process_directory
+
+    storage = DataStorage(storage_type, storage_file)
+    error = None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            process_directory(build_service(url), root, storage, workers=workers, engine=engine,
+                              service_factory=partial(build_service, url))
+        except Exception as e:
+            error = repr(e)
+    seconds = time.perf_counter() - start
+    storage.close()
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, error
+
+def bench_e2e(scenario, workdir, storage_type, workers, engine, faults):
+    from fake_youtube_server import FakeYouTubeServer
+
+    playlists, files, size_kib = SCENARIOS[scenario]
+    with contextlib.ExitStack() as stack:
+        if workdir is None:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory())
+        root = os.path.join(workdir, scenario)
+        _make_library(root, playlists, files, size_kib)
+        storage_file = os.path.join(stack.enter_context(tempfile.TemporaryDirectory()), f'bench.{storage_type}')
+        server = stack.enter_context(FakeYouTubeServer(**faults))
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            seconds, peak_kib, error = executor.submit(_process_library, server.url, root, storage_file,
+                                                       storage_type, workers, engine).result()
+
+        uploaded = len(server.videos)
+        total_bytes = server.bytes_received
+        print(f"{scenario}: {playlists * files:,} files of {size_kib:,} KiB in {playlists:,} playlists, "
+              f"{engine} engine, {workers} workers, {storage_type} storage")
+        if any(faults.values()):
+            print(f"  faults:      {', '.join(f'{name}={value}' for name, value in faults.items() if value)}")
+        print(f"  time:        {seconds:10.2f} s")
+        print(f"  files/hour:  {uploaded / seconds * 3600:10,.0f}")
+        print(f"  throughput:  {total_bytes / seconds / 1e6:10.2f} MB/s")
+        print(f"  API calls:   {sum(server.calls.values()):10,}  "
+              f"({', '.join(f'{name} {count:,}' for name, count in sorted(server.calls.items()))})")
+        print(f"  peak memory: {peak_kib / 1024:10.1f} MiB")
+        if error:
+            print(f"  stopped by:  {error}")
+
+def _time_command(command, runs, cwd, env=None):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=cwd, env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise RuntimeError(f"{' '.join(command)} failed:\n{result.stderr}")
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+def bench_startup(runs):
+    # Whole processes, interpreter start included, as a user would see them
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen', PYTHONPATH=here)
+    with tempfile.TemporaryDirectory() as workdir:
+        root = os.path.join(workdir, 'library')
+        _make_library(root, 2, 10, 1)
+        commands = (
+            ('python -c pass', [sys.executable, '-c', 'pass']),
+            ('CLI dry run', [sys.executable, os.path.join(here, 'youtube_uploader.py'), root, '--dry-run']),
+            ('GUI launch', [sys.executable, '-c', GUI_LAUNCH]),
+        )
+        print(f"Startup time, best and median of {runs} runs")
+        for name, command in commands:
+            best, median = _time_command(command, runs, workdir, env)
+            print(f"  {name:15} {best * 1000:8.0f} ms  {median * 1000:8.0f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description='YouTube uploader benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    csv_parser = subparsers.add_parser('csv-lookup', help='Video lookups in the CSV storage backend')
+    csv_parser.add_argument('--rows', type=int, default=100000, help='Number of stored videos')
+    csv_parser.add_argument('--lookups', type=int, default=10000, help='Number of lookups to time')
+
+    memory_parser = subparsers.add_parser('upload-memory', help='Memory use of concurrent uploads by media class')
+    memory_parser.add_argument('--files', type=int, default=4, help='Number of files uploaded at once')
+    memory_parser.add_argument('--size-mib', type=int, default=2048, help='Size of each file in MiB')
+    memory_parser.add_argument('--chunk-mib', type=int, default=64, help='Chunk size in MiB')
+
+    startup_parser = subparsers.add_parser('startup', help='Time to finish a CLI dry run and to open the GUI')
+    startup_parser.add_argument('--runs', type=int, default=10, help='Times each command is started')
+
+    e2e_parser = subparsers.add_parser('e2e', help='process_directory against the fake server, with optional faults')
+    e2e_parser.add_argument('scenario', choices=sorted(SCENARIOS), help='Library to upload')
+    e2e_parser.add_argument('--workdir', help='Keep the generated library here between runs')
+    e2e_parser.add_argument('--storage', choices=['sqlite', 'csv'], default='sqlite', help='Storage backend')
+    e2e_parser.add_argument('--workers', type=int, default=4, help='Uploads in parallel')
+    e2e_parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads', help='Upload engine')
+    e2e_parser.add_argument('--latency', type=float, default=0, help='Seconds the server adds to every request')
+    e2e_parser.add_argument('--bandwidth', type=float, default=None, help='Server upload cap in bytes per second')
+    e2e_parser.add_argument('--error-rate', type=float, default=0, help='Share of requests failed with a 503')
+    e2e_parser.add_argument('--quota-error-rate', type=float, default=0, help='Share of API calls failed for quota')
+    e2e_parser.add_argument('--drop-rate', type=float, default=0, help='Share of chunks whose connection is dropped')
+
+    args = parser.parse_args()
+    if args.benchmark == 'csv-lookup':
+        bench_csv_lookup(args.rows, args.lookups)
+    elif args.benchmark == 'upload-memory':
+        bench_upload_memory(args.files, args.size_mib, args.chunk_mib)
+    elif args.benchmark == 'startup':
+        bench_startup(args.runs)
+    elif args.benchmark == 'e2e':
+        faults = {'latency': args.latency, 'bandwidth': args.bandwidth, 'error_rate': args.error_rate,
+                  'quota_error_rate': args.quota_error_rate, 'drop_rate': args.drop_rate}
+        bench_e2e(args.scenario, args.workdir, args.storage, args.workers, args.engine, faults)
+
+if __name__ == '__main__':
+    main()
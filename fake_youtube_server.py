@@ -0,0 +1,360 @@
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from email.parser import Parser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# A local stand-in for the parts of the YouTube Data API used by youtube_uploader.py:
+# resumable videos.insert, playlists.list/insert and playlistItems.insert, also
+# inside multipart/mixed batch requests.
+# Uploaded bytes are counted but not kept, so multi-GB files are fine.
+# Faults can be injected to see how the uploader copes with a bad link or a
+# struggling API: added latency, a bandwidth cap shared by all connections,
+# 5xx and quota errors, and connections dropped halfway through a chunk.
+
+UPLOAD_PATH = '/upload/youtube/v3/videos'
+READ_BLOCK = 1024 * 1024
+
+class FakeYouTubeServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0, bandwidth=None, error_rate=0, quota_error_rate=0,
+                 drop_rate=0, seed=None, manual_sort=True):
+        self.latency = latency                    # seconds added to every request
+        self.bandwidth = bandwidth                # bytes per second accepted across all uploads, None for no cap
+        self.error_rate = error_rate              # share of requests answered with a 503
+        self.quota_error_rate = quota_error_rate  # share of API calls rejected with quotaExceeded
+        self.drop_rate = drop_rate                # share of chunks whose connection is cut halfway
+        self.manual_sort = manual_sort            # False: playlists refuse explicit positions, as when sorted by date
+        self.random = random.Random(seed)
+        self.calls = Counter()                    # requests served, by API method
+        self.bytes_received = 0
+        self._bandwidth_free_at = 0
+        self.lock = threading.Lock()
+        self.sessions = {}        # upload_id -> session state
+        self.videos = {}          # video_id -> video resource
+        self.playlists = {}       # playlist_id -> playlist resource
+        self.playlist_items = []  # (playlist_id, video_id) in insertion order
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-youtube', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def build_service(self):
+        return build_service(self.url)
+
+    def committed_bytes(self, upload_id):
+        with self.lock:
+            return self.sessions[upload_id]['received']
+
+    def chance(self, rate):
+        with self.lock:
+            return rate > 0 and self.random.random() < rate
+
+    def throttle(self, nbytes):
+        # Holds the caller until the shared bandwidth cap allows nbytes more
+        with self.lock:
+            self.bytes_received += nbytes
+            if not self.bandwidth:
+                return
+            now = time.monotonic()
+            start = max(now, self._bandwidth_free_at)
+            self._bandwidth_free_at = start + nbytes / self.bandwidth
+            wait = self._bandwidth_free_at - now
+        time.sleep(wait)
+
+def build_service(url):
+    # The bundled discovery document, pointed at a fake server instead of googleapis.com
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+    from googleapiclient.http import build_http
+
+    document = json.loads(get_static_doc('youtube', 'v3'))
+    document['rootUrl'] = url
+    document['baseUrl'] = url
+    return build_from_document(document, http=build_http())
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _discard_body(self, limit=None):
+        # Reads and drops the request body, or only its first `limit` bytes
+        length = int(self.headers.get('Content-Length') or 0)
+        if limit is not None:
+            length = min(length, limit)
+        while length > 0:
+            block = self.rfile.read(min(length, READ_BLOCK))
+            if not block:
+                break
+            length -= len(block)
+            self.fake.throttle(len(block))
+
+    def _fault(self, method):
+        # Counts the call and injects the configured faults. Returns True if it answered already.
+        with self.fake.lock:
+            self.fake.calls[method] += 1
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        if self.fake.chance(self.fake.error_rate):
+            self._discard_body()
+            self._send_error(503, 'backendError', 'Injected backend error')
+            return True
+        if method != 'videos.chunk' and self.fake.chance(self.fake.quota_error_rate):
+            self._discard_body()
+            self._send_error(403, 'quotaExceeded', 'Injected quota error')
+            return True
+        return False
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status, reason, message):
+        self._send(*_error(status, reason, message))
+
+    def do_GET(self):
+        if not self._fault(_api_method('GET', self.path)):
+            self._send(*self._dispatch('GET', self.path, {}))
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == UPLOAD_PATH and query.get('uploadType') == ['resumable']:
+            if not self._fault('videos.insert'):
+                self._start_session()
+        elif url.path == '/batch':
+            if not self._fault('batch'):
+                self._batch()
+        elif not self._fault(_api_method('POST', self.path)):
+            self._send(*self._dispatch('POST', self.path, self._read_json()))
+
+    def _dispatch(self, method, path, body):
+        # The JSON endpoints, shared by plain and batched requests. Returns (status, body).
+        url = urlsplit(path)
+        query = parse_qs(url.query)
+        if method == 'GET' and url.path == '/youtube/v3/playlists':
+            return self._list_playlists(query)
+        if method == 'POST' and url.path == '/youtube/v3/playlists':
+            return self._insert_playlist(body)
+        if method == 'POST' and url.path == '/youtube/v3/playlistItems':
+            return self._insert_playlist_item(body)
+        return _error(404, 'notFound', url.path)
+
+    def _batch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = self.rfile.read(length).decode('utf-8')
+        message = Parser().parsestr(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n{payload}")
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in message.get_payload():
+            request_line, _, rest = part.get_payload().partition('\n')
+            method, path, _ = request_line.split(' ', 2)
+            body = rest.replace('\r\n', '\n').partition('\n\n')[2]
+            with self.fake.lock:
+                self.fake.calls[_api_method(method, path)] += 1
+            if self.fake.chance(self.fake.quota_error_rate):
+                status, response = _error(403, 'quotaExceeded', 'Injected quota error')
+            else:
+                status, response = self._dispatch(method, path, json.loads(body) if body.strip() else {})
+            content_id = part['Content-ID'].replace('<', '<response-', 1)
+            parts.append(f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: {content_id}\r\n\r\n"
+                         f"HTTP/1.1 {status} {self.responses.get(status, ('',))[0]}\r\n"
+                         f"Content-Type: application/json; charset=UTF-8\r\n\r\n{json.dumps(response)}\r\n")
+        content = (''.join(parts) + f"--{boundary}--\r\n").encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/mixed; boundary={boundary}')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_PUT(self):
+        url = urlsplit(self.path)
+        upload_id = parse_qs(url.query).get('upload_id', [None])[0]
+        with self.fake.lock:
+            session = self.fake.sessions.get(upload_id)
+        if url.path != UPLOAD_PATH or session is None:
+            self._discard_body()
+            self._send_error(404, 'notFound', 'Upload session not found')
+            return
+        if self._fault('videos.chunk'):
+            return
+        if int(self.headers.get('Content-Length') or 0) and self.fake.chance(self.fake.drop_rate):
+            # Cut the connection halfway through the chunk, without committing any of it
+            self._discard_body(int(self.headers['Content-Length']) // 2)
+            self.close_connection = True
+            return
+        self._upload_chunk(session)
+
+    def _start_session(self):
+        metadata = self._read_json()
+        upload_id = uuid.uuid4().hex
+        size = self.headers.get('X-Upload-Content-Length')
+        with self.fake.lock:
+            self.fake.sessions[upload_id] = {
+                'metadata': metadata,
+                'size': int(size) if size else None,
+                'received': 0,
+                'video': None,
+            }
+        self._send(200, headers={'Location': f"{self.fake.url.rstrip('/')}{UPLOAD_PATH}?upload_id={upload_id}"})
+
+    def _upload_chunk(self, session):
+        # Content-Range is either "bytes first-last/total" for data or "bytes */total" for a status query
+        content_range = self.headers.get('Content-Range', '')
+        spec, _, total = content_range.replace('bytes ', '').partition('/')
+        if spec != '*' and spec:
+            first, _, last = spec.partition('-')
+            first, last = int(first), int(last)
+            if first != session['received']:
+                # Out of step with what we have; make the client re-query
+                self._discard_body()
+                self._send_resume_incomplete(session)
+                return
+            self._discard_body()
+            with self.fake.lock:
+                session['received'] = last + 1
+        else:
+            self._discard_body()
+
+        if total not in ('*', '') and session['received'] >= int(total):
+            self._finish(session)
+        else:
+            self._send_resume_incomplete(session)
+
+    def _send_resume_incomplete(self, session):
+        headers = {}
+        if session['received']:
+            headers['Range'] = f"bytes=0-{session['received'] - 1}"
+        self._send(308, headers=headers)
+
+    def _finish(self, session):
+        with self.fake.lock:
+            if session['video'] is None:
+                video_id = uuid.uuid4().hex[:11]
+                session['video'] = {
+                    'kind': 'youtube#video',
+                    'id': video_id,
+                    'snippet': session['metadata'].get('snippet', {}),
+                    'status': session['metadata'].get('status', {}),
+                }
+                self.fake.videos[video_id] = session['video']
+            video = session['video']
+        self._send(200, video)
+
+    def _list_playlists(self, query):
+        max_results = int(query.get('maxResults', ['5'])[0])
+        start = int(query.get('pageToken', ['0'])[0])
+        ids = query['id'][0].split(',') if 'id' in query else None
+        with self.fake.lock:
+            playlists = [dict(playlist, contentDetails={'itemCount': sum(1 for item in self.fake.playlist_items
+                                                                         if item[0] == playlist['id'])})
+                         for playlist in self.fake.playlists.values() if ids is None or playlist['id'] in ids]
+        page = playlists[start:start + max_results]
+        body = {'kind': 'youtube#playlistListResponse', 'items': page,
+                'pageInfo': {'totalResults': len(playlists), 'resultsPerPage': max_results}}
+        if start + max_results < len(playlists):
+            body['nextPageToken'] = str(start + max_results)
+        return 200, body
+
+    def _insert_playlist(self, body):
+        playlist_id = 'PL' + uuid.uuid4().hex
+        playlist = {'kind': 'youtube#playlist', 'id': playlist_id,
+                    'snippet': body.get('snippet', {}), 'status': body.get('status', {})}
+        with self.fake.lock:
+            self.fake.playlists[playlist_id] = playlist
+        return 200, playlist
+
+    def _insert_playlist_item(self, body):
+        snippet = body.get('snippet', {})
+        playlist_id = snippet.get('playlistId')
+        video_id = snippet.get('resourceId', {}).get('videoId')
+        with self.fake.lock:
+            position = snippet.get('position')
+            if playlist_id not in self.fake.playlists:
+                error = _error(404, 'playlistNotFound', f"Playlist {playlist_id} not found")
+            elif position is not None and not self.fake.manual_sort:
+                error = _error(400, 'manualSortRequired', "The playlist is not sorted manually")
+            else:
+                error = None
+                # Assumed rather than documented: a position past the end appends, like no position at all
+                indexes = [i for i, item in enumerate(self.fake.playlist_items) if item[0] == playlist_id]
+                if position is None or position >= len(indexes):
+                    self.fake.playlist_items.append((playlist_id, video_id))
+                else:
+                    self.fake.playlist_items.insert(indexes[position], (playlist_id, video_id))
+        if error:
+            return error
+        return 200, {'kind': 'youtube#playlistItem', 'id': uuid.uuid4().hex, 'snippet': snippet}
+
+def _api_method(method, path):
+    # 'playlists.list' for GET /youtube/v3/playlists, and so on
+    resource = urlsplit(path).path.rstrip('/').rsplit('/', 1)[-1]
+    return f"{resource}.{'list' if method == 'GET' else 'insert'}"
+
+def _error(status, reason, message):
+    return status, {'error': {'code': status, 'message': message,
+                              'errors': [{'reason': reason, 'message': message}]}}
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local stand-in for the YouTube Data API')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds added to every request')
+    parser.add_argument('--bandwidth', type=float, default=None, help='Upload cap in bytes per second')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of requests failed with a 503')
+    parser.add_argument('--quota-error-rate', type=float, default=0, help='Share of API calls failed for quota')
+    parser.add_argument('--drop-rate', type=float, default=0, help='Share of chunks whose connection is dropped')
+    args = parser.parse_args()
+
+    with FakeYouTubeServer(port=args.port, latency=args.latency, bandwidth=args.bandwidth,
+                           error_rate=args.error_rate, quota_error_rate=args.quota_error_rate,
+                           drop_rate=args.drop_rate) as server:
+        print(f"Serving fake YouTube API on {server.url}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
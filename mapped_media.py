@@ -0,0 +1,119 @@
+import mimetypes
+import mmap
+import os
+import threading
+
+from googleapiclient.http import MediaUpload
+
+from youtube_uploader import check_file_size
+
+# Upload media backed by a memory map of the video file. Kept apart from
+# youtube_uploader so that the Google client libraries are only imported once
+# an upload really starts.
+
+# Most bytes of video data held in memory for chunks being sent, across all uploads
+MEDIA_BUFFER_LIMIT = 512 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+class BufferBudget:
+    # Caps the bytes of video data held for chunks in flight, across all uploads.
+    # A chunk bigger than the whole budget still goes, but only on its own.
+    def __init__(self, limit=MEDIA_BUFFER_LIMIT):
+        self.limit = limit
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        nbytes = min(nbytes, self.limit)
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_use + nbytes <= self.limit)
+            self.in_use += nbytes
+        return nbytes
+
+    def release(self, nbytes):
+        with self.condition:
+            self.in_use -= nbytes
+            self.condition.notify_all()
+
+_media_budget = BufferBudget()
+
+class MappedMediaUpload(MediaUpload):
+    # Resumable media that hands out each chunk as a memoryview over an mmap
+    # of the file, so a chunk is never copied into a bytes object before it is
+    # written to the socket. Pages of a sent chunk are dropped again with
+    # madvise, and the bytes held at once are capped by a shared BufferBudget.
+    # The chunk size may change between chunks.
+    # This saves CPU time and read syscalls, not memory: mapped pages count
+    # towards RSS, which peaks higher than with MediaFileUpload (see
+    # `python benchmarks.py upload-memory`), though the kernel can drop them.
+    # A file that changes size fails its upload with FileChangedError.
+    def __init__(self, filename, mimetype=None, chunksize=DEFAULT_CHUNK_SIZE, resumable=True, budget=None):
+        self._filename = filename
+        self._mimetype = mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self._chunksize = chunksize
+        self._resumable = resumable
+        self._budget = budget or _media_budget
+        self._fd = None
+        self._fd = open(filename, 'rb')
+        self._size = os.fstat(self._fd.fileno()).st_size
+        self._map = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ) if self._size else None
+        self._view = memoryview(self._map) if self._map else memoryview(b'')
+        self._chunk = None
+        self._held = 0
+
+    def chunksize(self):
+        return self._chunksize
+
+    def set_chunksize(self, chunksize):
+        self._chunksize = chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return self._size
+
+    def resumable(self):
+        return self._resumable
+
+    def has_stream(self):
+        return False
+
+    def getbytes(self, begin, length):
+        self.release()
+        check_file_size(self._fd, self._size, self._filename)
+        end = min(begin + length, self._size)
+        self._held = self._budget.acquire(max(end - begin, 0))
+        self._chunk = self._view[begin:end]
+        self._chunk_range = (begin, end)
+        return self._chunk
+
+    def release(self):
+        # Called once the chunk from getbytes has been sent
+        if self._chunk is not None:
+            self._chunk.release()
+            self._chunk = None
+            begin, end = self._chunk_range
+            if hasattr(mmap, 'MADV_DONTNEED') and end > begin:
+                # The kernel reads the pages back from the file if they're needed again
+                begin -= begin % mmap.PAGESIZE
+                self._map.madvise(mmap.MADV_DONTNEED, begin, end - begin)
+        if self._held:
+            self._budget.release(self._held)
+            self._held = 0
+
+    def close(self):
+        if self._fd is None:
+            return
+        self.release()
+        try:
+            self._view.release()
+            if self._map:
+                self._map.close()
+        except BufferError:
+            pass  # A failed request's traceback still holds a view; the map goes with the last one
+        self._fd.close()
+        self._fd = None
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_uploader import COMPACT_MIN_DEAD_ROWS, DataStorage
+
+# CSV files that are rewritten on every chunk or quota spend must not grow without limit.
+
+class CSVCompactionTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.workdir.name, 'data.csv')
+        self.storage = DataStorage('csv', self.filename)
+
+    def tearDown(self):
+        self.storage.close()
+        self.workdir.cleanup()
+
+    def _lines(self, suffix):
+        with open(os.path.splitext(self.filename)[0] + suffix) as f:
+            return sum(1 for _ in f)
+
+    def test_sessions_are_compacted_while_open(self):
+        for offset in range(COMPACT_MIN_DEAD_ROWS * 5):
+            self.storage.save_upload_session('/videos/0.mp4', 'https://upload/0', offset, 10 ** 9, 1.0)
+        self.assertLessEqual(self._lines('_sessions.csv'), COMPACT_MIN_DEAD_ROWS + 2)
+        self.assertEqual(self.storage.get_upload_session('/videos/0.mp4'),
+                         ('https://upload/0', COMPACT_MIN_DEAD_ROWS * 5 - 1, 10 ** 9, 1.0))
+
+    def test_quota_is_compacted_while_open(self):
+        for _ in range(COMPACT_MIN_DEAD_ROWS * 5):
+            self.storage.add_quota_usage('2024-01-01', 1)
+        self.assertLessEqual(self._lines('_quota.csv'), COMPACT_MIN_DEAD_ROWS + 2)
+        self.assertEqual(self.storage.get_quota_usage('2024-01-01'), COMPACT_MIN_DEAD_ROWS * 5)
+
+if __name__ == '__main__':
+    unittest.main()
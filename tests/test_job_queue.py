@@ -0,0 +1,124 @@
+import contextlib
+import functools
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import youtube_uploader
+from fake_youtube_server import FakeYouTubeServer, build_service
+from youtube_uploader import DataStorage
+
+# The shared job queue against the local fake API: claims, leases and failures.
+# Run with `python -m unittest discover tests`.
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.workdir.name, 'videos')
+        os.makedirs(os.path.join(self.root, 'holiday'))
+        self.storage = DataStorage('sqlite', os.path.join(self.workdir.name, 'data.sqlite'))
+
+    def tearDown(self):
+        self.storage.close()
+        self.workdir.cleanup()
+
+    def _make_videos(self, count):
+        paths = []
+        for i in range(count):
+            path = os.path.join(self.root, 'holiday', f'video_{i}.mp4')
+            with open(path, 'wb') as f:
+                f.write(os.urandom(1000 + i))
+            paths.append(path)
+        return paths
+
+    def _status(self, file_path):
+        return self.storage.backend._fetchone("SELECT status FROM jobs WHERE file_path = ?", (file_path,))[0]
+
+    def _run(self, server):
+        with contextlib.redirect_stdout(io.StringIO()):
+            youtube_uploader.process_directory(build_service(server.url), self.root, self.storage, workers=2,
+                                               dedupe='off', job_queue=True,
+                                               service_factory=functools.partial(build_service, server.url))
+        self.storage.flush()
+
+    def test_claims_do_not_overlap(self):
+        self.storage.enqueue_jobs([(f'/videos/{i}.mp4', 'holiday', 1) for i in range(4)])
+        first = self.storage.claim_jobs('node-a', 2, 60)
+        second = self.storage.claim_jobs('node-b', 3, 60)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({job[0] for job in first} & {job[0] for job in second})
+        self.assertEqual(self.storage.claim_jobs('node-c', 1, 60), [])
+
+    def test_expired_lease_is_claimed_again(self):
+        self.storage.enqueue_jobs([('/videos/0.mp4', 'holiday', 1)])
+        self.assertEqual(len(self.storage.claim_jobs('node-a', 1, -1)), 1)
+        self.assertEqual(len(self.storage.claim_jobs('node-b', 1, 60)), 1)
+        # node-a lost the lease, so it can no longer finish the file
+        self.storage.finish_job('/videos/0.mp4', 'node-a', 'done')
+        self.storage.flush()
+        self.assertEqual(self._status('/videos/0.mp4'), 'leased')
+        self.storage.release_jobs('node-b')
+        self.storage.flush()
+        self.assertEqual(self._status('/videos/0.mp4'), 'queued')
+
+    def test_failed_job_is_queued_again(self):
+        self.storage.enqueue_jobs([('/videos/0.mp4', 'holiday', 1)])
+        self.storage.claim_jobs('node-a', 1, 60)
+        self.storage.finish_job('/videos/0.mp4', 'node-a', 'failed')
+        self.storage.enqueue_jobs([('/videos/0.mp4', 'holiday', 1)])
+        self.assertEqual(self._status('/videos/0.mp4'), 'queued')
+
+    def test_missing_file_does_not_stop_the_queue(self):
+        paths = self._make_videos(3)
+        missing = os.path.join(self.root, 'holiday', 'deleted.mp4')
+        self.storage.enqueue_jobs([(missing, 'holiday', 1)])
+        with FakeYouTubeServer() as server:
+            self._run(server)
+            self.assertEqual(len(server.videos), 3)
+            # A second run has nothing left to trip over either
+            self._run(server)
+            self.assertEqual(len(server.videos), 3)
+        self.assertEqual(self._status(missing), 'failed')
+        self.assertEqual([self._status(path) for path in paths], ['done'] * 3)
+
+    def test_file_deleted_before_upload_is_failed(self):
+        paths = self._make_videos(3)
+        upload_video = youtube_uploader.upload_video
+
+        def delete_first(youtube, file_path, *args, **kwargs):
+            if file_path == paths[0] and os.path.exists(file_path):
+                os.remove(file_path)
+            return upload_video(youtube, file_path, *args, **kwargs)
+
+        with FakeYouTubeServer() as server, mock.patch.object(youtube_uploader, 'upload_video', delete_first):
+            self._run(server)
+            self.assertEqual(len(server.videos), 2)
+        self.assertEqual([self._status(path) for path in paths], ['failed', 'done', 'done'])
+
+    def test_failed_upload_is_retried_by_the_next_run(self):
+        paths = self._make_videos(3)
+        upload_video = youtube_uploader.upload_video
+
+        def fail_first(youtube, file_path, *args, **kwargs):
+            if file_path == paths[0]:
+                raise RuntimeError('transient')
+            return upload_video(youtube, file_path, *args, **kwargs)
+
+        with FakeYouTubeServer() as server:
+            with mock.patch.object(youtube_uploader, 'upload_video', fail_first):
+                with self.assertRaises(RuntimeError):
+                    self._run(server)
+            self.storage.flush()
+            self.assertEqual(self._status(paths[0]), 'failed')
+            self._run(server)
+            self.assertEqual(len(server.videos), 3)
+        self.assertEqual([self._status(path) for path in paths], ['done'] * 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import mmap
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mapped_media import MappedMediaUpload
+from youtube_uploader import FileChangedError, fingerprint_file
+
+# Files that shrink while mapped must fail their upload, not kill the process with SIGBUS.
+
+class TruncatedFileTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, 'video.mp4')
+        with open(self.path, 'wb') as f:
+            f.write(os.urandom(4 * 1024 * 1024))
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_chunk_of_truncated_file_fails(self):
+        media = MappedMediaUpload(self.path, chunksize=1024 * 1024)
+        try:
+            self.assertEqual(len(media.getbytes(0, 1024 * 1024)), 1024 * 1024)
+            os.truncate(self.path, 1024)
+            with self.assertRaises(FileChangedError):
+                bytes(media.getbytes(2 * 1024 * 1024, 1024 * 1024))
+        finally:
+            media.close()
+
+    def test_fingerprint_of_truncated_file_fails(self):
+        real_mmap = mmap.mmap
+
+        def map_then_truncate(*args, **kwargs):
+            mapped = real_mmap(*args, **kwargs)
+            os.truncate(self.path, 1024)
+            return mapped
+
+        with mock.patch.object(mmap, 'mmap', map_then_truncate), self.assertRaises(FileChangedError):
+            fingerprint_file(self.path, full_hash=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_youtube_server import FakeYouTubeServer
+from youtube_uploader import DataStorage, PlaylistItemQueue
+
+# Batched playlist attachments against the local fake API.
+
+class PlaylistItemQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.storage = DataStorage('sqlite', os.path.join(self.workdir.name, 'data.sqlite'))
+
+    def tearDown(self):
+        self.storage.close()
+        self.workdir.cleanup()
+
+    def _playlist(self, youtube):
+        return youtube.playlists().insert(part="snippet", body={"snippet": {"title": "holiday"}}).execute()['id']
+
+    def _statuses(self):
+        return sorted(row[4] for row in self.storage.backend._connection().execute("SELECT * FROM videos"))
+
+    def test_items_keep_their_order(self):
+        with FakeYouTubeServer() as server:
+            youtube = server.build_service()
+            playlist_id = self._playlist(youtube)
+            queue = PlaylistItemQueue(self.storage)
+            for i in range(5):
+                queue.put(playlist_id, f'video_{i}', f'video_{i}', f'/videos/{i}.mp4')
+            self.assertTrue(queue.flush(youtube, final=True))
+            self.assertEqual(server.playlist_items, [(playlist_id, f'video_{i}') for i in range(5)])
+        self.storage.flush()
+        self.assertEqual(self._statuses(), ['uploaded'] * 5)
+
+    def test_playlist_not_sorted_manually_gets_items_without_positions(self):
+        with FakeYouTubeServer(manual_sort=False) as server:
+            youtube = server.build_service()
+            playlist_id = self._playlist(youtube)
+            queue = PlaylistItemQueue(self.storage)
+            for i in range(3):
+                queue.put(playlist_id, f'video_{i}', f'video_{i}', f'/videos/{i}.mp4')
+            self.assertTrue(queue.flush(youtube, final=True))
+            self.assertEqual(sorted(server.playlist_items), [(playlist_id, f'video_{i}') for i in range(3)])
+        self.storage.flush()
+        self.assertEqual(self._statuses(), ['uploaded'] * 3)
+
+    def test_failed_items_are_sent_again_by_the_next_queue(self):
+        with FakeYouTubeServer() as server:
+            youtube = server.build_service()
+            queue = PlaylistItemQueue(self.storage, max_attempts=1)
+            queue.put('PLmissing', 'video_0', 'video_0', '/videos/0.mp4')
+            with contextlib.redirect_stdout(io.StringIO()):
+                queue.flush(youtube, final=True)
+            self.storage.flush()
+            self.assertEqual(self._statuses(), ['playlist_failed'])
+
+            # The playlist is there now, e.g. after being restored
+            playlist_id = self._playlist(youtube)
+            self.storage.add_video('video_0', 'video_0', playlist_id, '/videos/0.mp4', 'playlist_failed')
+            self.storage.flush()
+            queue = PlaylistItemQueue(self.storage)
+            self.assertEqual(len(queue), 1)
+            self.assertTrue(queue.flush(youtube, final=True))
+            self.assertEqual(server.playlist_items, [(playlist_id, 'video_0')])
+        self.storage.flush()
+        self.assertEqual(self._statuses(), ['uploaded'])
+
+if __name__ == '__main__':
+    unittest.main()
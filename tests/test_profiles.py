@@ -0,0 +1,84 @@
+import contextlib
+import functools
+import io
+import json
+import os
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import youtube_uploader
+from fake_youtube_server import FakeYouTubeServer, build_service
+from youtube_uploader import DataStorage
+
+# Credential profiles for more than one channel, each channel a fake API of its own.
+
+PROFILES = {'profiles': {'main': {'token': 'main.json'},
+                         'lectures': {'token': 'lectures.json', 'channel': 'lectures'}},
+            'channels': {'lectures': ['lectures_*']}}
+
+class ChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.workdir.name, 'videos')
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def _write(self, relative_path, data):
+        path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def _profiles(self, storage, urls):
+        profiles_file = os.path.join(self.workdir.name, 'profiles.json')
+        with open(profiles_file, 'w') as f:
+            json.dump(PROFILES, f)
+        pool = youtube_uploader.load_profiles(profiles_file, storage)
+        for profile in pool.profiles:
+            # Signed in already, against that channel's server
+            profile.service = lambda url=urls[profile.name]: build_service(url)
+            profile.get_credentials = lambda: types.SimpleNamespace(refresh_token=None, expiry=None)
+        return pool
+
+    def _check_channels_kept_apart(self, storage_type):
+        copied = os.urandom(4000)
+        self._write('talks/talk.mp4', copied)
+        self._write('lectures_a/first.mp4', os.urandom(4001))
+        storage = DataStorage(storage_type, os.path.join(self.workdir.name, f'data.{storage_type}'))
+        try:
+            with FakeYouTubeServer() as main, FakeYouTubeServer() as lectures:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    # Everything on the main channel, before lectures_* had one of its own
+                    youtube_uploader.process_directory(build_service(main.url), self.root, storage,
+                                                       service_factory=functools.partial(build_service, main.url))
+                    self._write('lectures_a/copy_of_talk.mp4', copied)
+                    self._write('lectures_a/second.mp4', os.urandom(4002))
+                    youtube_uploader.process_directory(None, self.root, storage,
+                                                       profiles=self._profiles(storage, {'main': main.url,
+                                                                                         'lectures': lectures.url}))
+                storage.flush()
+                self.assertEqual(len(main.videos), 2)
+                # The copy is uploaded again, as the main channel's video is no use to this one
+                self.assertEqual(len(lectures.videos), 2)
+                self.assertEqual(len(lectures.playlists), 1)
+                lectures_playlist = next(iter(lectures.playlists))
+                self.assertEqual(sorted(playlist for playlist, _ in lectures.playlist_items),
+                                 [lectures_playlist] * 2)
+                self.assertEqual(storage.get_playlist('lectures_a', 'lectures')[0], lectures_playlist)
+                self.assertNotEqual(storage.get_playlist('lectures_a')[0], lectures_playlist)
+        finally:
+            storage.close()
+
+    def test_channels_kept_apart_sqlite(self):
+        self._check_channels_kept_apart('sqlite')
+
+    def test_channels_kept_apart_csv(self):
+        self._check_channels_kept_apart('csv')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Counters and timings for the uploader. Everything is kept in memory and can
+# also go to a JSON-lines event log, a Prometheus text file (for the node
+# exporter's textfile collector) and a Prometheus HTTP endpoint.
+
+# Aggregate throughput, and so the ETA, is measured over this many seconds
+RATE_WINDOW = 60
+# How often the Prometheus text file is rewritten, in seconds
+PROMETHEUS_WRITE_INTERVAL = 10
+
+HELP = {
+    'youtube_uploader_uploads_total': 'Videos finished, by outcome',
+    'youtube_uploader_upload_seconds': 'Time to upload one video',
+    'youtube_uploader_upload_bytes_total': 'Video bytes sent, including resent chunks',
+    'youtube_uploader_chunk_seconds': 'Time to send one chunk',
+    'youtube_uploader_retries_total': 'Requests retried, by error',
+    'youtube_uploader_api_calls_total': 'YouTube API requests made, by method',
+    'youtube_uploader_quota_units_total': 'YouTube API quota units spent',
+    'youtube_uploader_storage_seconds': 'Storage lookup latency, by method',
+    'youtube_uploader_scan_seconds': 'Time to list the video library',
+}
+
+def format_duration(seconds):
+    # "1h 05m", "3m 20s", "12s", or "unknown" for None
+    if seconds is None:
+        return 'unknown'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()                # one writer of the Prometheus file at a time
+        self.counters = defaultdict(float)                # (name, labels) -> value
+        self.summaries = defaultdict(lambda: [0, 0.0])    # (name, labels) -> [count, sum]
+        self.recent_bytes = deque()                       # (monotonic time, bytes) within RATE_WINDOW
+        self._log = None
+        self._prometheus_file = None
+        self._written_at = 0
+        self._server = None
+
+    def configure(self, log_file=None, prometheus_file=None, port=None):
+        if log_file:
+            self._log = open(log_file, 'a', buffering=1)
+        self._prometheus_file = prometheus_file
+        if port is not None:
+            self.serve(port)
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            summary = self.summaries[(name, tuple(sorted(labels.items())))]
+            summary[0] += 1
+            summary[1] += value
+        self._maybe_write()
+
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def sent(self, nbytes, seconds):
+        # One chunk of video data went out
+        now = time.monotonic()
+        with self.lock:
+            self.counters[('youtube_uploader_upload_bytes_total', ())] += nbytes
+            self.recent_bytes.append((now, nbytes))
+            while self.recent_bytes and self.recent_bytes[0][0] < now - RATE_WINDOW:
+                self.recent_bytes.popleft()
+        self.observe('youtube_uploader_chunk_seconds', seconds)
+
+    def rate(self):
+        # Bytes per second sent by all uploads together, lately
+        now = time.monotonic()
+        with self.lock:
+            while self.recent_bytes and self.recent_bytes[0][0] < now - RATE_WINDOW:
+                self.recent_bytes.popleft()
+            if not self.recent_bytes:
+                return 0
+            span = max(now - self.recent_bytes[0][0], 1)
+            return sum(nbytes for _, nbytes in self.recent_bytes) / span
+
+    def eta(self, remaining_bytes):
+        # Seconds left at the current aggregate rate, or None before anything was measured
+        rate = self.rate()
+        return remaining_bytes / rate if rate else None
+
+    def event(self, kind, **fields):
+        if self._log is None:
+            return
+        line = json.dumps({'time': time.time(), 'event': kind, **fields})
+        with self.lock:
+            self._log.write(line + '\n')
+
+    def render(self):
+        # Prometheus text exposition format
+        with self.lock:
+            counters = dict(self.counters)
+            summaries = {key: list(value) for key, value in self.summaries.items()}
+        lines = []
+        names = sorted({name for name, _ in counters} | {name for name, _ in summaries})
+        for name in names:
+            kind = 'summary' if any(key[0] == name for key in summaries) else 'counter'
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+            for (metric, labels), (count, total) in sorted(summaries.items()):
+                if metric == name:
+                    lines.append(f"{name}_count{_labels(labels)} {count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+        return '\n'.join(lines) + '\n'
+
+    def _maybe_write(self):
+        if self._prometheus_file and time.monotonic() - self._written_at >= PROMETHEUS_WRITE_INTERVAL:
+            self.write_prometheus()
+
+    def write_prometheus(self):
+        # Written to a temporary file first, so the collector never reads half a file.
+        # The temporary name is unique, as other processes may write the same file.
+        if not self._prometheus_file:
+            return
+        with self.write_lock:
+            self._written_at = time.monotonic()
+            text = self.render()
+            directory = os.path.dirname(os.path.abspath(self._prometheus_file))
+            with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as f:
+                f.write(text)
+            # Readable by a collector running as another user, as a file made with open() would be
+            os.chmod(f.name, 0o644)
+            try:
+                os.replace(f.name, self._prometheus_file)
+            except OSError:
+                os.remove(f.name)
+                raise
+
+    def serve(self, port, host=''):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True).start()
+
+    def close(self):
+        self.write_prometheus()
+        if self._log:
+            self._log.close()
+            self._log = None
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self.started
+        self.metrics.observe(self.name, self.seconds, **self.labels)
+
+def _number(value):
+    # Counters stay exact; 6.00004e+06 would hide the last bytes
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+# Shared by everything in the process
+metrics = Metrics()
@@ -1,31 +1,157 @@
 import os
 import json
 import argparse
+import atexit
+import contextlib
 import csv
+import fnmatch
+import hashlib
+import mmap
+import queue
+import random
+import socket
 import sqlite3
+import threading
 import time
-from ssl import SSLEOFError
-from googleapiclient.errors import HttpError, ResumableUploadError
-from googleapiclient.http import MediaFileUpload
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from itertools import zip_longest
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from http.client import HTTPException
+from upload_metrics import format_duration, metrics
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/youtube.force-ssl']
 secret_file = r"C:\\Users\\Ishu\\Downloads\\client_secret_35310042494-noak3r3jdjhnlgl6c1b7be384iqn614j.apps.googleusercontent.com.json"
 token_file = "token.json"
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v')
+# CSV files are rewritten on open once dead rows outnumber live ones (and this many)
+COMPACT_MIN_DEAD_ROWS = 1000
+# How long the channel's playlist listing kept in storage is trusted, in seconds
+PLAYLIST_CATALOGUE_TTL = 6 * 60 * 60
+# API units each call costs, and the default daily allowance of a project
+QUOTA_COSTS = {
+    'videos.insert': 1600,
+    'playlistItems.insert': 50,
+    'playlists.list': 1,
+    'playlists.insert': 50,
+}
+# Reserved for each upload: the video, and adding it to its playlist
+UPLOAD_QUOTA_COST = QUOTA_COSTS['videos.insert'] + QUOTA_COSTS['playlistItems.insert']
+DAILY_QUOTA = 10000
+# The daily quota resets at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+# Requests per batch HTTP request for playlist operations
+PLAYLIST_BATCH_SIZE = 50
+# Fingerprints hash this many evenly spaced samples of each file, plus its size
+FINGERPRINT_SAMPLES = 8
+FINGERPRINT_SAMPLE_SIZE = 1024 * 1024
+# Files fingerprinted at a time, just ahead of their uploads
+FINGERPRINT_BATCH_SIZE = 256
+# Resumable uploads send chunks in multiples of this many bytes
+UPLOAD_CHUNK_ALIGNMENT = 256 * 1024
+# Bounds for the adaptive chunk size, the size of the first chunk, and the
+# duration each chunk is sized for
+CHUNK_SIZE_MIN = UPLOAD_CHUNK_ALIGNMENT
+CHUNK_SIZE_MAX = 128 * 1024 * 1024
+CHUNK_SIZE_INITIAL = 8 * 1024 * 1024
+CHUNK_TARGET_SECONDS = 8
+# Upload errors retried in place, resuming from what the server has confirmed.
+# OSError covers socket, SSL and timeout errors; httplib2's own errors are
+# added where they're checked, as httplib2 is only imported for real uploads.
+RETRYABLE_STATUSES = (500, 502, 503, 504)
+RETRYABLE_ERRORS = (OSError, HTTPException)
+RETRY_MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 64
+# Failures in a row, across all workers, that pause every upload, and for how many seconds
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_COOLDOWN = 60
+# With a bandwidth limit, each chunk is about this many seconds of traffic
+BANDWIDTH_CHUNK_SECONDS = 2
+RATE_UNITS = {'K': 1000, 'M': 1000 ** 2, 'G': 1000 ** 3}
+# Priorities read from this file in the root directory, unless another file is given
+PRIORITIES_FILE = 'priorities.json'
+# SQLite journal modes that may be picked; 'wal' only works with every process on one machine
+SQLITE_JOURNAL_MODES = ('wal', 'delete', 'truncate', 'persist')
+# A file claimed from the shared job queue stays reserved for its node this many
+# seconds after the node's last heartbeat; heartbeats come three times as often
+JOB_LEASE_SECONDS = 5 * 60
+# How often a node with nothing left to claim checks on files other nodes hold
+JOB_POLL_INTERVAL = 5
+# Watch mode uploads a new file once its size and mtime have held still this
+# many seconds, and checks for new files this often
+WATCH_SETTLE_SECONDS = 10
+WATCH_POLL_INTERVAL = 5
+
+# Tokens are refreshed between uploads once they expire within this many
+# seconds, rather than by whichever chunk request finds them expired
+TOKEN_REFRESH_MARGIN = 10 * 60
+
+# Workers may refresh and rewrite the token file at the same time
+_token_lock = threading.Lock()
+# Credentials are loaded once per process; services are built once per thread,
+# as httplib2 clients are not thread safe
+_credentials = None
+_services = threading.local()
 
 class QuotaExceededError(Exception):
     pass
 
+class FileChangedError(Exception):
+    # A video changed size while it was being read, e.g. one still being written
+    pass
+
+def check_file_size(f, size, file_path):
+    # Touching a memory map past the end of a file that has shrunk kills the process
+    # with SIGBUS, so the size is checked again before each read through a map
+    if os.fstat(f.fileno()).st_size != size:
+        raise FileChangedError(f"{file_path} changed size while being read")
+
 def get_authenticated_service():
+    # Return the authenticated YouTube API service
+    youtube = getattr(_services, 'youtube', None)
+    if youtube is None:
+        from googleapiclient.discovery import build
+
+        # The API description bundled with googleapiclient, never fetched over the network
+        youtube = _services.youtube = build('youtube', 'v3', credentials=get_credentials(), static_discovery=True)
+    return youtube
+
+def get_credentials():
+    global _credentials
+    with _token_lock:
+        if _credentials is None:
+            _credentials = _load_credentials()
+        return _credentials
+
+def refresh_credentials(creds=None, margin=TOKEN_REFRESH_MARGIN, token_path=None):
+    # Refresh the token ahead of time if it expires within margin seconds, so a
+    # refresh happens between uploads instead of in the middle of one
+    with _token_lock:
+        creds = creds or _credentials
+        if creds is None or not creds.refresh_token or not creds.expiry:
+            return
+        # google-auth keeps expiry as naive UTC
+        if creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None) > timedelta(seconds=margin):
+            return
+        from google.auth.transport.requests import Request
+
+        creds.refresh(Request())
+        _save_credentials(creds, token_path)
+
+def _load_credentials(token_path=None, secret_path=None):
+    # token.json and the default client secrets, unless a profile has its own
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    token_path = token_path or token_file
     creds = None
 
     # Check if the token file exists, and load it
-    if os.path.exists(token_file):
-        creds = Credentials.from_authorized_user_file(token_file, SCOPES)
+    if os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
 
     # If credentials are not valid, refresh or generate new ones
     if not creds or not creds.valid:
@@ -33,107 +159,870 @@ def get_authenticated_service():
             creds.refresh(Request())
         else:
             # Use the correct secret file for the OAuth flow
-            flow = InstalledAppFlow.from_client_secrets_file(secret_file, SCOPES)
+            flow = InstalledAppFlow.from_client_secrets_file(secret_path or secret_file, SCOPES)
             creds = flow.run_local_server(port=0)
 
         # Save the credentials to the token file for future use
-        with open(token_file, 'w') as token:
-            token.write(creds.to_json())
+        _save_credentials(creds, token_path)
 
-    # Return the authenticated YouTube API service
-    return build('youtube', 'v3', credentials=creds)
+    return creds
+
+def _save_credentials(creds, token_path=None):
+    with open(token_path or token_file, 'w') as token:
+        token.write(creds.to_json())
 
 class DataStorage:
-    def __init__(self, storage_type, filename):
+    def __init__(self, storage_type, filename, journal_mode='wal'):
         self.storage_type = storage_type
         self.filename = filename
         if storage_type == 'sqlite':
-            self.conn = sqlite3.connect(filename)
-            self.cursor = self.conn.cursor()
-            self.cursor.execute('''CREATE TABLE IF NOT EXISTS videos
-                                (id TEXT PRIMARY KEY, title TEXT, playlist_id TEXT, file_path TEXT, status TEXT)''')
-            self.cursor.execute('''CREATE TABLE IF NOT EXISTS playlists
-                                (id TEXT PRIMARY KEY, name TEXT)''')
-            self.conn.commit()
+            self.backend = SQLiteStorage(filename, journal_mode)
         elif storage_type == 'csv':
-            if not os.path.exists(filename):
-                with open(filename, 'w', newline='') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(['id', 'title', 'playlist_id', 'file_path', 'status'])
-    
+            self.backend = CSVStorage(filename)
+        else:
+            raise ValueError(f"Unknown storage type: {storage_type}")
+
+    def __getattr__(self, name):
+        attribute = getattr(self.backend, name)
+        if not name.startswith(('get_', 'find_')):
+            return attribute
+
+        def timed(*args, **kwargs):
+            with metrics.timer('youtube_uploader_storage_seconds', method=name):
+                return attribute(*args, **kwargs)
+        return timed
+
+class SQLiteStorage:
+    # Reads go through one connection per thread, which WAL mode lets run
+    # alongside writes. Writes are queued to a single writer thread that
+    # commits everything waiting in one transaction (group commit), so many
+    # uploads finishing together cost one fsync instead of one each.
+    # WAL needs memory shared between the processes using the database, so a
+    # database on a network filesystem used by several machines needs the
+    # 'delete' journal mode instead.
+    def __init__(self, filename, journal_mode='wal'):
+        if journal_mode not in SQLITE_JOURNAL_MODES:
+            raise ValueError(f"Unknown journal mode: {journal_mode}")
+        self.filename = filename
+        self.journal_mode = journal_mode
+        self._local = threading.local()
+        self._writes = queue.Queue()
+        conn = self._connection()
+        conn.execute(f'PRAGMA journal_mode={journal_mode}')
+        # Older databases keyed videos by id, which left room for only one file per video
+        if any(column[1] == 'id' and column[5] for column in conn.execute('PRAGMA table_info(videos)')):
+            conn.executescript('''ALTER TABLE videos RENAME TO videos_by_id;
+                                  CREATE TABLE videos
+                                  (id TEXT, title TEXT, playlist_id TEXT, file_path TEXT PRIMARY KEY, status TEXT);
+                                  INSERT OR REPLACE INTO videos SELECT * FROM videos_by_id ORDER BY rowid;
+                                  DROP TABLE videos_by_id;''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS videos
+                        (id TEXT, title TEXT, playlist_id TEXT, file_path TEXT PRIMARY KEY, status TEXT)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS playlists
+                        (id TEXT PRIMARY KEY, name TEXT, channel TEXT)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS upload_sessions
+                        (file_path TEXT PRIMARY KEY, session_uri TEXT, offset INTEGER, size INTEGER, mtime REAL)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS meta
+                        (key TEXT PRIMARY KEY, value TEXT)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS quota_usage
+                        (profile TEXT, day TEXT, units INTEGER, PRIMARY KEY (profile, day))''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS fingerprints
+                        (file_path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sample_hash TEXT, full_hash TEXT)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                        (file_path TEXT PRIMARY KEY, playlist_name TEXT, size INTEGER, position INTEGER,
+                         status TEXT, owner TEXT, lease_expires REAL)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS locks
+                        (name TEXT PRIMARY KEY, owner TEXT, expires REAL)''')
+        # Older databases knew of one channel only, which is the default one (NULL)
+        if not any(column[1] == 'channel' for column in conn.execute('PRAGMA table_info(playlists)')):
+            conn.execute('ALTER TABLE playlists ADD COLUMN channel TEXT')
+            # Other channels' listings are fetched again, so their playlists are stored under them
+            conn.execute("DELETE FROM meta WHERE key LIKE 'playlist_catalogue_fetched_at:%'")
+        conn.execute('CREATE INDEX IF NOT EXISTS videos_status ON videos (status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS playlists_name ON playlists (name)')
+        conn.execute('CREATE INDEX IF NOT EXISTS fingerprints_sample ON fingerprints (size, sample_hash)')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, position)')
+        conn.commit()
+        self._writer = threading.Thread(target=self._write_loop, name='sqlite-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.filename, timeout=30)
+        # With WAL, NORMAL only syncs at checkpoints and is still safe against corruption
+        conn.execute('PRAGMA synchronous=NORMAL' if self.journal_mode == 'wal' else 'PRAGMA synchronous=FULL')
+        return conn
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _fetchone(self, sql, params=()):
+        return self._connection().execute(sql, params).fetchone()
+
+    def _write(self, sql, params, wait=True):
+        # Queue a statement for the writer thread; with wait, block until it is committed
+        if not self._writer.is_alive():
+            raise sqlite3.ProgrammingError("Storage is closed")
+        write = {'sql': sql, 'params': params, 'done': threading.Event() if wait else None, 'error': None}
+        self._writes.put(write)
+        if wait:
+            write['done'].wait()
+            if write['error']:
+                raise write['error']
+
+    def _write_loop(self):
+        conn = self._connect()
+        running = True
+        while running:
+            batch = [self._writes.get()]
+            # Everything that queued up during the last commit goes into this one
+            while True:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [write for write in batch if write is not None]
+
+            for write in batch:
+                try:
+                    conn.execute(write['sql'], write['params'])
+                except sqlite3.Error as e:
+                    write['error'] = e
+            try:
+                conn.commit()
+            except sqlite3.Error as e:
+                for write in batch:
+                    write['error'] = write['error'] or e
+            for write in batch:
+                if write['done']:
+                    write['done'].set()
+        conn.close()
+
+    def flush(self):
+        # Returns once every write queued so far is committed
+        self._write('SELECT 1', ())
+
+    def close(self):
+        if self._writer.is_alive():
+            self._writes.put(None)
+            self._writer.join()
+
     def get_video(self, file_path):
-        if self.storage_type == 'sqlite':
-            self.cursor.execute("SELECT * FROM videos WHERE file_path = ? AND status != 'dry_run'", (file_path,))
-            return self.cursor.fetchone()
-        elif self.storage_type == 'csv':
-            with open(self.filename, 'r', newline='') as f:
-                reader = csv.reader(f)
-                next(reader)  # Skip header
-                for row in reader:
-                    if len(row) >= 5:
-                        if row[3] == file_path and row[4] != 'dry_run':
-                            return row
-        return None
-    
+        return self._fetchone("SELECT * FROM videos WHERE file_path = ? AND status != 'dry_run'", (file_path,))
+
     def add_video(self, video_id, title, playlist_id, file_path, status='uploaded'):
-        if self.storage_type == 'sqlite':
-            self.cursor.execute("INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?)",
-                                (video_id, title, playlist_id, file_path, status))
-            self.conn.commit()
-        elif self.storage_type == 'csv':
-            with open(self.filename, 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([video_id, title, playlist_id, file_path, status])
-    
+        self._write("INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?)",
+                    (video_id, title, playlist_id, file_path, status))
+
     def add_dry_run_video(self, title, playlist_id, file_path):
-        if self.storage_type == 'csv':
-            with open(self.filename, 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['DRY_RUN', title, playlist_id, file_path, 'dry_run'])
-
-    def get_playlist(self, name):
-        if self.storage_type == 'sqlite':
-            self.cursor.execute("SELECT * FROM playlists WHERE name = ?", (name,))
-            return self.cursor.fetchone()
-        elif self.storage_type == 'csv':
+        pass
+
+    def get_videos_by_status(self, status):
+        return self._connection().execute("SELECT * FROM videos WHERE status = ?", (status,)).fetchall()
+
+    def get_playlist(self, name, channel=None):
+        return self._fetchone("SELECT * FROM playlists WHERE name = ? AND channel IS ?", (name, channel))
+
+    def add_playlist(self, playlist_id, name, channel=None):
+        self._write("INSERT OR REPLACE INTO playlists VALUES (?, ?, ?)", (playlist_id, name, channel))
+
+    def get_playlists(self):
+        # (id, name, channel) of every channel's playlists
+        return self._connection().execute("SELECT id, name, channel FROM playlists").fetchall()
+
+    def add_playlists(self, playlists, channel=None):
+        for playlist_id, name in playlists:
+            self._write("INSERT OR REPLACE INTO playlists VALUES (?, ?, ?)", (playlist_id, name, channel),
+                        wait=False)
+        self.flush()
+
+    def get_fingerprint(self, file_path):
+        return self._fetchone("SELECT size, mtime, sample_hash, full_hash FROM fingerprints WHERE file_path = ?",
+                              (file_path,))
+
+    def add_fingerprints(self, fingerprints):
+        for fingerprint in fingerprints:
+            self._write("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)", fingerprint, wait=False)
+        self.flush()
+
+    def find_video_by_fingerprint(self, size, sample_hash, full_hash=None, channel=None):
+        # Full hashes are only compared when both files have one. Only videos on channel
+        # count, going by their playlist; those in playlists not stored are the default channel's.
+        return self._fetchone('''SELECT videos.* FROM fingerprints
+                                 JOIN videos ON videos.file_path = fingerprints.file_path
+                                 LEFT JOIN playlists ON playlists.id = videos.playlist_id
+                                 WHERE fingerprints.size = ? AND fingerprints.sample_hash = ?
+                                 AND (? IS NULL OR fingerprints.full_hash IS NULL OR fingerprints.full_hash = ?)
+                                 AND videos.status != 'dry_run' AND playlists.channel IS ? LIMIT 1''',
+                              (size, sample_hash, full_hash, full_hash, channel))
+
+    def get_quota_usage(self, day, profile='default'):
+        row = self._fetchone("SELECT units FROM quota_usage WHERE profile = ? AND day = ?", (profile, day))
+        return row[0] if row else 0
+
+    def add_quota_usage(self, day, units, profile='default'):
+        self._write('''INSERT INTO quota_usage VALUES (?, ?, ?)
+                       ON CONFLICT (profile, day) DO UPDATE SET units = units + excluded.units''',
+                    (profile, day, units))
+
+    def set_quota_usage(self, day, units, profile='default'):
+        self._write("INSERT OR REPLACE INTO quota_usage VALUES (?, ?, ?)", (profile, day, units))
+
+    def get_meta(self, key):
+        row = self._fetchone("SELECT value FROM meta WHERE key = ?", (key,))
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self._write("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def get_upload_session(self, file_path):
+        return self._fetchone("SELECT session_uri, offset, size, mtime FROM upload_sessions WHERE file_path = ?",
+                              (file_path,))
+
+    def save_upload_session(self, file_path, session_uri, offset, size, mtime):
+        # Updated after every chunk; the server is asked for the real offset on resume anyway
+        self._write("INSERT OR REPLACE INTO upload_sessions VALUES (?, ?, ?, ?, ?)",
+                    (file_path, session_uri, offset, size, mtime), wait=False)
+
+    def delete_upload_session(self, file_path):
+        self._write("DELETE FROM upload_sessions WHERE file_path = ?", (file_path,), wait=False)
+
+    def enqueue_jobs(self, jobs):
+        # jobs: (file_path, playlist_name, size) in upload order, queued after what is there.
+        # Files already in the queue keep their place and status, except that failed ones
+        # are queued again, at the back.
+        row = self._fetchone("SELECT MAX(position) FROM jobs")
+        start = (row[0] if row[0] is not None else -1) + 1
+        for position, (file_path, playlist_name, size) in enumerate(jobs, start):
+            self._write('''INSERT INTO jobs VALUES (?, ?, ?, ?, 'queued', NULL, NULL)
+                           ON CONFLICT (file_path) DO UPDATE SET status = 'queued', position = excluded.position,
+                                                                 owner = NULL, lease_expires = NULL
+                           WHERE status = 'failed' ''', (file_path, playlist_name, size, position), wait=False)
+        self.flush()
+
+    def claim_jobs(self, owner, count, lease_seconds):
+        # Lease up to count queued files, or files whose lease ran out, to owner. Runs in its
+        # own immediate transaction rather than through the writer thread, so the files read
+        # are still free when they're taken, whichever process or machine asks at the same time.
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            jobs = conn.execute('''SELECT file_path, playlist_name, size FROM jobs
+                                   WHERE status = 'queued' OR (status = 'leased' AND lease_expires < ?)
+                                   ORDER BY position LIMIT ?''', (now, count)).fetchall()
+            conn.executemany("UPDATE jobs SET status = 'leased', owner = ?, lease_expires = ? WHERE file_path = ?",
+                             [(owner, now + lease_seconds, job[0]) for job in jobs])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return jobs
+
+    def renew_leases(self, owner, lease_seconds):
+        self._write("UPDATE jobs SET lease_expires = ? WHERE owner = ? AND status = 'leased'",
+                    (time.time() + lease_seconds, owner))
+
+    def finish_job(self, file_path, owner, status='done'):
+        # Only while owner still holds the lease; status 'queued' hands the file back
+        self._write('''UPDATE jobs SET status = ?, lease_expires = NULL
+                       WHERE file_path = ? AND owner = ? AND status = 'leased' ''', (status, file_path, owner))
+
+    def release_jobs(self, owner):
+        # Everything owner still holds goes back to the queue
+        self._write('''UPDATE jobs SET status = 'queued', owner = NULL, lease_expires = NULL
+                       WHERE owner = ? AND status = 'leased' ''', (owner,))
+
+    def count_jobs(self, status):
+        return self._fetchone("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,))[0]
+
+    def acquire_lock(self, name, owner, seconds):
+        # True if owner now holds the named lock: it was free, had run out or was owner's already
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT owner, expires FROM locks WHERE name = ?", (name,)).fetchone()
+            acquired = row is None or row[0] == owner or row[1] < now
+            if acquired:
+                conn.execute("INSERT OR REPLACE INTO locks VALUES (?, ?, ?)", (name, owner, now + seconds))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return acquired
+
+    def release_lock(self, name, owner):
+        self._write("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+    def compact(self):
+        pass
+
+class CSVTable:
+    # An append-only CSV file that is read once into a dict keyed by one column
+    # (or a tuple of columns). A later row replaces an earlier one with the same key, and a row with only
+    # the key filled in deletes it. Rows that no longer count are rewritten away
+    # by compact(), once they outnumber the live ones, so files rewritten on every
+    # chunk stay small through a long --watch run.
+    def __init__(self, filename, columns, key, indexed=None):
+        self.filename = filename
+        self.columns = columns
+        self.key_columns = [columns.index(name) for name in ((key,) if isinstance(key, str) else key)]
+        self.indexed = indexed  # rows it rejects are kept in the file but never returned
+        self.index = {}
+        self.legacy_rows = []  # rows with a different column count, from older file layouts
+        self.dead_rows = 0
+        if os.path.exists(self.filename) and os.path.getsize(self.filename):
             with open(self.filename, 'r', newline='') as f:
                 reader = csv.reader(f)
                 next(reader)  # Skip header
                 for row in reader:
-                    if len(row) >= 2:
-                        if row[1] == name:
-                            return row
+                    self._apply(row)
+            self._file = open(self.filename, 'a', newline='')
+        else:
+            self._file = open(self.filename, 'w', newline='')
+            csv.writer(self._file).writerow(columns)
+            self._file.flush()
+        self._writer = csv.writer(self._file)
+
+    def _apply(self, row):
+        if len(row) != len(self.columns):
+            self.legacy_rows.append(row)
+            self.dead_rows += 1
+            return
+
+        key = self._key(row)
+        if not any(value for i, value in enumerate(row) if i not in self.key_columns):
+            if self.index.pop(key, None) is not None:
+                self.dead_rows += 1
+            self.dead_rows += 1
+        elif self.indexed and not self.indexed(row):
+            self.dead_rows += 1
+        else:
+            if key in self.index:
+                self.dead_rows += 1
+            self.index[key] = row
+
+    def _key(self, row):
+        if len(self.key_columns) == 1:
+            return row[self.key_columns[0]]
+        return tuple(row[i] for i in self.key_columns)
+
+    def get(self, key):
+        return self.index.get(key)
+
+    def append(self, row):
+        row = ['' if value is None else str(value) for value in row]
+        self._writer.writerow(row)
+        self._file.flush()
+        self._apply(row)
+        # Legacy rows wait for CSVStorage to migrate them when it opens
+        if not self.legacy_rows and self.needs_compaction():
+            self.compact()
+
+    def delete(self, key):
+        row = [''] * len(self.columns)
+        for i, value in zip(self.key_columns, (key,) if len(self.key_columns) == 1 else key):
+            row[i] = value
+        self.append(row)
+
+    def needs_compaction(self):
+        return self.dead_rows > max(COMPACT_MIN_DEAD_ROWS, len(self.index))
+
+    def compact(self):
+        self._file.close()
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            writer.writerows(self.index.values())
+        os.replace(temp_filename, self.filename)
+        self.dead_rows = 0
+        self.legacy_rows = []
+        self._file = open(self.filename, 'a', newline='')
+        self._writer = csv.writer(self._file)
+
+    def close(self):
+        self._file.close()
+
+class CSVStorage:
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.RLock()
+        base = os.path.splitext(filename)[0]
+        self.videos = CSVTable(filename, ['id', 'title', 'playlist_id', 'file_path', 'status'], 'file_path',
+                               indexed=lambda row: row[4] != 'dry_run')
+        # The channel is empty for the default one
+        self.playlists = CSVTable(base + '_playlists.csv', ['id', 'name', 'channel'], ('name', 'channel'))
+        # Sessions are rewritten on every chunk, so they get their own file
+        self.sessions = CSVTable(base + '_sessions.csv', ['file_path', 'session_uri', 'offset', 'size', 'mtime'],
+                                 'file_path')
+        self.meta = CSVTable(base + '_meta.csv', ['key', 'value'], 'key')
+        self.fingerprints = CSVTable(base + '_fingerprints.csv',
+                                     ['file_path', 'size', 'mtime', 'sample_hash', 'full_hash'], 'file_path')
+        self.quota_usage = CSVTable(base + '_quota.csv', ['profile', 'day', 'units'], ('profile', 'day'))
+        self.tables = (self.videos, self.playlists, self.sessions, self.meta, self.fingerprints, self.quota_usage)
+        # (size, sample_hash) -> paths with that fingerprint
+        self.paths_by_fingerprint = {}
+        for row in self.fingerprints.index.values():
+            self.paths_by_fingerprint.setdefault((int(row[1]), row[3]), set()).add(row[0])
+
+        # Older versions kept playlists as two-column rows in the videos file, and then
+        # in their own file without a channel, which makes them the default channel's
+        for row in self.videos.legacy_rows + self.playlists.legacy_rows:
+            if len(row) == 2 and self.playlists.get((row[1], '')) is None:
+                self.playlists.append(row + [''])
+        if self.playlists.legacy_rows:
+            # Other channels' listings are fetched again, so their playlists are stored under them
+            for key in list(self.meta.index):
+                if key.startswith('playlist_catalogue_fetched_at:'):
+                    self.meta.delete(key)
+        self.playlist_channels = {row[0]: row[2] for row in self.playlists.index.values()}  # id -> channel
+
+        for table in self.tables:
+            if table.needs_compaction() or table.legacy_rows:
+                table.compact()
+
+    def get_video(self, file_path):
+        with self.lock:
+            return self.videos.get(file_path)
+
+    def add_video(self, video_id, title, playlist_id, file_path, status='uploaded'):
+        with self.lock:
+            self.videos.append([video_id, title, playlist_id, file_path, status])
+
+    def add_dry_run_video(self, title, playlist_id, file_path):
+        with self.lock:
+            self.videos.append(['DRY_RUN', title, playlist_id, file_path, 'dry_run'])
+
+    def get_videos_by_status(self, status):
+        with self.lock:
+            return [row for row in self.videos.index.values() if row[4] == status]
+
+    def get_playlist(self, name, channel=None):
+        with self.lock:
+            return self.playlists.get((name, channel or ''))
+
+    def add_playlist(self, playlist_id, name, channel=None):
+        with self.lock:
+            self.playlists.append([playlist_id, name, channel])
+            self.playlist_channels[playlist_id] = channel or ''
+
+    def get_playlists(self):
+        # (id, name, channel) of every channel's playlists
+        with self.lock:
+            return [(row[0], row[1], row[2] or None) for row in self.playlists.index.values()]
+
+    def add_playlists(self, playlists, channel=None):
+        with self.lock:
+            for playlist_id, name in playlists:
+                self.add_playlist(playlist_id, name, channel)
+
+    def get_fingerprint(self, file_path):
+        with self.lock:
+            row = self.fingerprints.get(file_path)
+            if row is None:
+                return None
+            return int(row[1]), float(row[2]), row[3], row[4] or None
+
+    def add_fingerprints(self, fingerprints):
+        with self.lock:
+            for file_path, size, mtime, sample_hash, full_hash in fingerprints:
+                old = self.fingerprints.get(file_path)
+                if old is not None:
+                    self.paths_by_fingerprint.get((int(old[1]), old[3]), set()).discard(file_path)
+                self.fingerprints.append([file_path, size, mtime, sample_hash, full_hash])
+                self.paths_by_fingerprint.setdefault((size, sample_hash), set()).add(file_path)
+
+    def find_video_by_fingerprint(self, size, sample_hash, full_hash=None, channel=None):
+        # Full hashes are only compared when both files have one. Only videos on channel
+        # count, going by their playlist; those in playlists not stored are the default channel's.
+        with self.lock:
+            for file_path in self.paths_by_fingerprint.get((size, sample_hash), ()):
+                stored_full_hash = self.fingerprints.get(file_path)[4]
+                if full_hash and stored_full_hash and stored_full_hash != full_hash:
+                    continue
+                video = self.videos.get(file_path)
+                if video is not None and self.playlist_channels.get(video[2], '') == (channel or ''):
+                    return video
         return None
-    
-    def add_playlist(self, playlist_id, name):
-        if self.storage_type == 'sqlite':
-            self.cursor.execute("INSERT OR REPLACE INTO playlists VALUES (?, ?)", (playlist_id, name))
-            self.conn.commit()
-        elif self.storage_type == 'csv':
-            with open(self.filename, 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([playlist_id, name])
-
-def create_or_get_playlist(youtube, playlist_name, storage):
-    stored_playlist = storage.get_playlist(playlist_name)
+
+    def get_quota_usage(self, day, profile='default'):
+        with self.lock:
+            row = self.quota_usage.get((profile, day))
+            return int(row[2]) if row else 0
+
+    def add_quota_usage(self, day, units, profile='default'):
+        with self.lock:
+            self.quota_usage.append([profile, day, self.get_quota_usage(day, profile) + units])
+
+    def set_quota_usage(self, day, units, profile='default'):
+        with self.lock:
+            self.quota_usage.append([profile, day, units])
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.meta.get(key)
+            return row[1] if row else None
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.meta.append([key, value])
+
+    def get_upload_session(self, file_path):
+        with self.lock:
+            row = self.sessions.get(file_path)
+            if row is None:
+                return None
+            return row[1], int(row[2]), int(row[3]), float(row[4])
+
+    def save_upload_session(self, file_path, session_uri, offset, size, mtime):
+        with self.lock:
+            self.sessions.append([file_path, session_uri, offset, size, mtime])
+
+    def delete_upload_session(self, file_path):
+        with self.lock:
+            if self.sessions.get(file_path) is not None:
+                self.sessions.delete(file_path)
+
+    def compact(self):
+        # Drop superseded, deleted and dry-run rows from every file
+        with self.lock:
+            for table in self.tables:
+                table.compact()
+
+    def flush(self):
+        pass  # Every append is flushed as it is written
+
+    def close(self):
+        with self.lock:
+            for table in self.tables:
+                table.close()
+
+class QuotaAccountant:
+    # Counts the API units spent per Pacific-time day in storage, so an upload
+    # is only started when the budget left today covers it. Callers that don't
+    # fit wait for the midnight reset (or get QuotaExceededError if not waiting).
+    def __init__(self, storage, daily_limit=DAILY_QUOTA, profile='default', wait_for_reset=True, on_wait=None):
+        self.storage = storage
+        self.daily_limit = daily_limit
+        self.profile = profile
+        self.wait_for_reset = wait_for_reset
+        self.on_wait = on_wait  # called with a message when starting to wait for the reset
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def today(self):
+        return datetime.now(QUOTA_TIMEZONE).date().isoformat()
+
+    def seconds_until_reset(self):
+        now = datetime.now(QUOTA_TIMEZONE)
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), QUOTA_TIMEZONE)
+        return max((midnight - now).total_seconds(), 0)
+
+    def remaining(self):
+        return max(self.daily_limit - self.storage.get_quota_usage(self.today(), self.profile), 0)
+
+    def spend(self, units):
+        # For calls that are made regardless of the budget, like listing playlists
+        self.storage.add_quota_usage(self.today(), units, self.profile)
+        metrics.inc('youtube_uploader_quota_units_total', units, profile=self.profile)
+
+    def try_reserve(self, units):
+        with self.lock:
+            if self.remaining() < units:
+                return False
+            self.spend(units)
+            return True
+
+    def reserve(self, units, description='the next request'):
+        while not self.try_reserve(units):
+            if not self.wait_for_reset:
+                raise QuotaExceededError(f"Not enough API quota left today for {description}.")
+            wait = self.seconds_until_reset() + 60
+            message = (f"Quota budget used up; waiting {wait / 3600:.1f} hours for the Pacific-time reset "
+                       f"before {description}.")
+            print(message)
+            if self.on_wait:
+                self.on_wait(message)
+            if self.stop_event.wait(wait):
+                raise QuotaExceededError("Stopped while waiting for the quota to reset.")
+
+    def exhaust(self):
+        # The API rejected a call for quota: nothing more can be spent today
+        self.storage.set_quota_usage(self.today(), self.daily_limit, self.profile)
+
+    def stop(self):
+        self.stop_event.set()
+
+class CredentialProfile:
+    # The token of one API project, and so a daily quota of its own, counted in
+    # storage under the profile's name. Profiles without a channel are for the
+    # default one; those with one upload to that channel instead.
+    def __init__(self, name, token_path, storage, secret_path=None, channel=None, daily_limit=DAILY_QUOTA):
+        self.name = name
+        self.token_path = token_path
+        self.secret_path = secret_path
+        self.channel = channel
+        # Never waits for the reset itself: the pool does, once no profile has quota left
+        self.quota = QuotaAccountant(storage, daily_limit, profile=name, wait_for_reset=False)
+        self.catalogue = PlaylistCatalogue(storage, quota=self.quota, channel=channel)
+        self.lock = threading.Lock()
+        self.credentials = None
+        self._services = threading.local()
+
+    def get_credentials(self):
+        with self.lock:
+            if self.credentials is None:
+                self.credentials = _load_credentials(self.token_path, self.secret_path)
+            return self.credentials
+
+    def service(self):
+        # Once per thread, like get_authenticated_service
+        youtube = getattr(self._services, 'youtube', None)
+        if youtube is None:
+            from googleapiclient.discovery import build
+
+            youtube = self._services.youtube = build('youtube', 'v3', credentials=self.get_credentials(),
+                                                     static_discovery=True)
+        return youtube
+
+    def refresh(self, margin=TOKEN_REFRESH_MARGIN):
+        refresh_credentials(self.get_credentials(), margin, self.token_path)
+
+class CredentialPool:
+    # Several credential profiles, so the day's capacity is the sum of their
+    # projects' quotas. A playlist belongs to the first channel whose patterns
+    # match its name, or to the default channel, and every request for it goes
+    # through whichever of that channel's profiles has the most quota left.
+    def __init__(self, storage, profiles, channels=None, wait_for_reset=True):
+        self.storage = storage
+        self.profiles = profiles
+        self.channels = channels or {}  # channel -> glob patterns of playlist names
+        self.wait_for_reset = wait_for_reset
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self._names = {}  # playlist id -> name
+
+    def authenticate(self):
+        # Any sign-in happens now, not in a worker thread halfway through the run
+        for profile in self.profiles:
+            profile.get_credentials()
+
+    def channel_for(self, playlist_name):
+        for channel, patterns in self.channels.items():
+            if any(fnmatch.fnmatchcase(playlist_name, pattern) for pattern in patterns):
+                return channel
+        return None
+
+    def pick(self, playlist_name, units=0):
+        # The channel's profile with the most quota left. If even that one can't cover
+        # units, wait for the reset (or raise QuotaExceededError if not waiting).
+        channel = self.channel_for(playlist_name)
+        candidates = [profile for profile in self.profiles if profile.channel == channel]
+        if not candidates:
+            raise ValueError(f"No credential profile for the channel of playlist {playlist_name}")
+        while True:
+            profile = max(candidates, key=lambda candidate: candidate.quota.remaining())
+            if profile.quota.remaining() >= units:
+                return profile
+            if not self.wait_for_reset:
+                raise QuotaExceededError(f"No profile for playlist {playlist_name} has enough API quota left today.")
+            wait = profile.quota.seconds_until_reset() + 60
+            print(f"Quota budget of every profile for playlist {playlist_name} used up; waiting "
+                  f"{wait / 3600:.1f} hours for the Pacific-time reset.")
+            if self.stop_event.wait(wait):
+                raise QuotaExceededError("Stopped while waiting for the quota to reset.")
+
+    def pick_for_id(self, playlist_id, units=0):
+        with self.lock:
+            if playlist_id not in self._names:
+                self._names = {stored_id: name for stored_id, name, _ in self.storage.get_playlists()}
+            playlist_name = self._names.get(playlist_id)
+        if playlist_name is None:
+            raise ValueError(f"Playlist {playlist_id} is not in storage")
+        return self.pick(playlist_name, units)
+
+    def stop(self):
+        self.stop_event.set()
+        for profile in self.profiles:
+            profile.quota.stop()
+
+def load_profiles(profiles_file, storage, daily_limit=DAILY_QUOTA, wait_for_reset=True):
+    # A JSON file such as
+    #   {"profiles": {"main": {"token": "main.json"},
+    #                 "spare": {"token": "spare.json", "secrets": "client_secret_spare.json", "daily_quota": 20000},
+    #                 "lectures": {"token": "lectures.json", "channel": "lectures"}},
+    #    "channels": {"lectures": ["lectures_*", "talks_*"]}}
+    # Paths are relative to the file. Without "secrets", new tokens are made with the default client secrets.
+    with open(profiles_file, 'r') as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(profiles_file))
+    channels = config.get('channels', {})
+    profiles = []
+    for name, profile in config.get('profiles', {}).items():
+        if 'token' not in profile:
+            raise ValueError(f"Profile {name} in {profiles_file} has no token file")
+        channel = profile.get('channel')
+        if channel is not None and channel not in channels:
+            raise ValueError(f"Profile {name} is for channel {channel}, which has no playlists in {profiles_file}")
+        secret_path = os.path.join(base, profile['secrets']) if 'secrets' in profile else None
+        profiles.append(CredentialProfile(name, os.path.join(base, profile['token']), storage, secret_path, channel,
+                                          profile.get('daily_quota', daily_limit)))
+    if not profiles:
+        raise ValueError(f"{profiles_file} has no profiles")
+    return CredentialPool(storage, profiles, channels, wait_for_reset)
+
+def parse_rate(text):
+    # Bytes per second from e.g. "500K", "2M" or "1.5G"; "off" or 0 means unlimited
+    text = text.strip().upper().rstrip('B')
+    if text in ('OFF', 'NONE', ''):
+        return None
+    multiplier = 1
+    if text[-1] in RATE_UNITS:
+        multiplier = RATE_UNITS[text[-1]]
+        text = text[:-1]
+    rate = int(float(text) * multiplier)
+    return rate or None
+
+def parse_bandwidth_schedule(text):
+    # "08:00=2M,18:00=off" -> [(480, 2000000), (1080, None)], in minutes after local midnight
+    schedule = []
+    for entry in text.split(','):
+        start, _, rate = entry.partition('=')
+        hours, _, minutes = start.strip().partition(':')
+        schedule.append((int(hours) * 60 + int(minutes or 0), parse_rate(rate)))
+    return sorted(schedule)
+
+class BandwidthLimiter:
+    # A token bucket shared by every upload in the process. Each chunk is paid
+    # for before it is sent; a chunk that overdraws the bucket waits until the
+    # debt is paid back, and later chunks queue up behind it. Uploads get
+    # turns in the order they ask, so concurrent uploads share the rate evenly.
+    # The rate can follow a local time-of-day schedule; None is unlimited.
+    def __init__(self, rate=None, schedule=None, burst_seconds=1):
+        self.default_rate = rate
+        self.schedule = schedule or []
+        self.burst_seconds = burst_seconds
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.tokens = 0
+        self.last_refill = time.monotonic()
+
+    def rate(self):
+        if not self.schedule:
+            return self.default_rate
+        now = datetime.now()
+        minute = now.hour * 60 + now.minute
+        rate = self.schedule[-1][1]  # Before the first entry, the last one still applies from yesterday
+        for start, scheduled_rate in self.schedule:
+            if start <= minute:
+                rate = scheduled_rate
+        return rate
+
+    def chunk_size(self):
+        # Chunks of about BANDWIDTH_CHUNK_SECONDS at the current rate keep the
+        # pacing smooth; None leaves the client library's default
+        rate = self.rate()
+        if rate is None:
+            return None
+        return max(rate * BANDWIDTH_CHUNK_SECONDS // UPLOAD_CHUNK_ALIGNMENT, 1) * UPLOAD_CHUNK_ALIGNMENT
+
+    def acquire(self, nbytes):
+        # Blocks until nbytes may be sent. Returns False if the limiter was stopped meanwhile.
+        rate = self.rate()
+        with self.lock:
+            now = time.monotonic()
+            if rate is None:
+                self.tokens = 0
+                self.last_refill = now
+                return not self.stop_event.is_set()
+            self.tokens = min(self.tokens + (now - self.last_refill) * rate, rate * self.burst_seconds)
+            self.last_refill = now
+            self.tokens -= nbytes
+            wait = -self.tokens / rate if self.tokens < 0 else 0
+        return not self.stop_event.wait(wait)
+
+    def stop(self):
+        self.stop_event.set()
+
+def fetch_playlists(youtube, quota=None):
+    # Every playlist on the channel, following nextPageToken through all pages
+    playlists = {}
+    request = youtube.playlists().list(part="snippet", mine=True, maxResults=50)
+    while request is not None:
+        if quota:
+            quota.spend(QUOTA_COSTS['playlists.list'])
+        response = execute_with_retry(request)
+        for item in response.get('items', []):
+            playlists.setdefault(item['snippet']['title'], item['id'])
+        request = youtube.playlists().list_next(request, response)
+    return playlists
+
+class PlaylistCatalogue:
+    # Channel playlists by title. The full listing is fetched at most once per
+    # run and not again until the copy kept in storage is older than ttl seconds.
+    def __init__(self, storage, ttl=PLAYLIST_CATALOGUE_TTL, quota=None, channel=None):
+        self.storage = storage
+        self.ttl = ttl
+        self.quota = quota
+        self.channel = channel
+        self.fetched_key = 'playlist_catalogue_fetched_at' + (f':{channel}' if channel else '')
+        self.lock = threading.Lock()
+        self.playlists = None
+
+    def _load(self, youtube):
+        fetched_at = self.storage.get_meta(self.fetched_key)
+        if fetched_at is None or time.time() - float(fetched_at) >= self.ttl:
+            remote = fetch_playlists(youtube, self.quota)
+            self.storage.add_playlists(((playlist_id, name) for name, playlist_id in remote.items()), self.channel)
+            self.storage.set_meta(self.fetched_key, time.time())
+        self.playlists = {}
+        for playlist_id, name, channel in self.storage.get_playlists():
+            if channel == self.channel:
+                self.playlists.setdefault(name, playlist_id)
+
+    def get(self, youtube, name):
+        with self.lock:
+            if self.playlists is None:
+                self._load(youtube)
+            return self.playlists.get(name)
+
+    def add(self, playlist_id, name):
+        with self.lock:
+            if self.playlists is not None:
+                self.playlists[name] = playlist_id
+
+def create_or_get_playlist(youtube, playlist_name, storage, catalogue=None, quota=None, profiles=None):
+    channel = profiles.channel_for(playlist_name) if profiles is not None else None
+    stored_playlist = storage.get_playlist(playlist_name, channel)
     if stored_playlist:
         return stored_playlist[0]
 
+    if profiles is not None:
+        # Found or created in the playlist's own channel
+        profile = profiles.pick(playlist_name, QUOTA_COSTS['playlists.insert'])
+        youtube, catalogue, quota = profile.service(), profile.catalogue, profile.quota
+
     if youtube is None:  # Dry run mode
         playlist_id = f"dry_run_playlist_{playlist_name}"
-        storage.add_playlist(playlist_id, playlist_name)
+        storage.add_playlist(playlist_id, playlist_name, channel)
         return playlist_id
 
-    request = youtube.playlists().list(
-        part="snippet",
-        mine=True
-    )
-    response = request.execute()
+    if catalogue is None:
+        catalogue = PlaylistCatalogue(storage, quota=quota)
+    playlist_id = catalogue.get(youtube, playlist_name)
+    if playlist_id:
+        storage.add_playlist(playlist_id, playlist_name, channel)
+        return playlist_id
 
-    for item in response['items']:
-        if item['snippet']['title'] == playlist_name:
-            storage.add_playlist(item['id'], playlist_name)
-            return item['id']
+    if quota:
+        quota.reserve(QUOTA_COSTS['playlists.insert'], f"creating playlist {playlist_name}")
 
     request = youtube.playlists().insert(
         part="snippet,status",
@@ -146,13 +1035,465 @@ def create_or_get_playlist(youtube, playlist_name, storage):
           }
         }
     )
-    response = request.execute()
-    storage.add_playlist(response['id'], playlist_name)
+    response = execute_with_retry(request)
+    storage.add_playlist(response['id'], playlist_name, channel)
+    catalogue.add(response['id'], playlist_name)
     return response['id']
 
-def upload_video(youtube, file_path, playlist_id, storage, update_file_progress):
-    max_retries = 5
-    retry_delay = 5  # seconds
+def is_quota_error(error):
+    details = error.error_details if isinstance(error.error_details, list) else []
+    reasons = [detail.get('reason') for detail in details if isinstance(detail, dict)]
+    return error.resp.status == 403 and ('quotaExceeded' in reasons or 'dailyLimitExceeded' in reasons)
+
+class PlaylistItemQueue:
+    # Playlist attachments for finished uploads, sent through the API's batch
+    # endpoint instead of one request each. Queued videos are stored with the
+    # 'pending_playlist' status, so attachments left over by an interrupted run
+    # are sent by the next one, as are those that failed ('playlist_failed'). The
+    # server may apply the parts of a batch in any order, so a playlist with
+    # several items in a batch gets each one's position spelled out, counting from
+    # the playlist's length just before the batch. Playlists not sorted manually
+    # refuse positions, and get theirs without.
+    def __init__(self, storage, quota=None, batch_size=PLAYLIST_BATCH_SIZE, max_attempts=3):
+        self.storage = storage
+        self.quota = quota
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.items = []  # [playlist_id, video_id, video_title, file_path, attempts]
+        self.unpositioned = set()  # playlists that refused an explicit position, not being sorted manually
+        # Attachments that ran out of attempts in an earlier run get another go too
+        for status in ('pending_playlist', 'playlist_failed'):
+            for video_id, video_title, playlist_id, file_path, _ in storage.get_videos_by_status(status):
+                self.items.append([playlist_id, video_id, video_title, file_path, 0])
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+    def put(self, playlist_id, video_id, video_title, file_path):
+        self.storage.add_video(video_id, video_title, playlist_id, file_path, 'pending_playlist')
+        with self.lock:
+            self.items.append([playlist_id, video_id, video_title, file_path, 0])
+
+    def flush(self, youtube, final=False):
+        # Send a batch once enough items are waiting, or everything when final.
+        # Returns False if the quota ran out, leaving the rest for later.
+        with self.flush_lock:
+            while True:
+                with self.lock:
+                    if not self.items or (not final and len(self.items) < self.batch_size):
+                        return True
+                    batch = self.items[:self.batch_size]
+                    del self.items[:self.batch_size]
+                if not self._send(youtube, batch):
+                    return False
+
+    def _positions(self, youtube, batch):
+        # Where each item goes: None to append, or an index for playlists with several items in the batch
+        from googleapiclient.errors import HttpError
+
+        counts = {}
+        for item in batch:
+            counts[item[0]] = counts.get(item[0], 0) + 1
+        shared = [playlist_id for playlist_id, count in counts.items()
+                  if count > 1 and playlist_id not in self.unpositioned]
+        if not shared:
+            return [None] * len(batch)
+        if self.quota:
+            self.quota.spend(QUOTA_COSTS['playlists.list'])
+        try:
+            response = execute_with_retry(youtube.playlists().list(part="contentDetails", id=','.join(shared),
+                                                                   maxResults=PLAYLIST_BATCH_SIZE))
+        except HttpError as e:
+            # Sent without positions, in order, which the server usually keeps
+            print(f"Could not read playlist lengths, sending the batch without positions: {e}")
+            return [None] * len(batch)
+        lengths = {item['id']: item['contentDetails']['itemCount'] for item in response.get('items', [])}
+        positions = []
+        for playlist_id, *_ in batch:
+            if playlist_id in shared and playlist_id in lengths:
+                positions.append(lengths[playlist_id])
+                lengths[playlist_id] += 1
+            else:
+                positions.append(None)
+        return positions
+
+    def _send(self, youtube, batch):
+        from googleapiclient.errors import HttpError
+
+        errors = {}
+
+        def callback(request_id, response, exception):
+            errors[request_id] = exception
+
+        positions = self._positions(youtube, batch)
+        request = youtube.new_batch_http_request(callback=callback)
+        for i, ((playlist_id, video_id, _, _, _), position) in enumerate(zip(batch, positions)):
+            snippet = {
+                "playlistId": playlist_id,
+                "resourceId": {
+                    "kind": "youtube#video",
+                    "videoId": video_id
+                }
+            }
+            if position is not None:
+                snippet["position"] = position
+            request.add(youtube.playlistItems().insert(part="snippet", body={"snippet": snippet}), request_id=str(i))
+        try:
+            metrics.inc('youtube_uploader_api_calls_total', method='batch')
+            request.execute()
+        except (HttpError, OSError) as e:
+            print(f"Playlist batch failed, will retry: {e}")
+            errors = {str(i): e for i in range(len(batch))}
+
+        retry = []
+        quota_exceeded = False
+        for i, item in enumerate(batch):
+            playlist_id, video_id, video_title, file_path, attempts = item
+            error = errors.get(str(i))
+            if error is None:
+                self.storage.add_video(video_id, video_title, playlist_id, file_path, 'uploaded')
+            elif isinstance(error, HttpError) and is_quota_error(error):
+                quota_exceeded = True
+                retry.append(item)
+            elif isinstance(error, HttpError) and error.resp.status == 400 and positions[i] is not None:
+                # manualSortRequired: the playlist sorts itself, so it is sent again without a position
+                self.unpositioned.add(playlist_id)
+                retry.append(item)
+            elif attempts + 1 < self.max_attempts and not (isinstance(error, HttpError) and error.resp.status == 404):
+                item[4] += 1
+                retry.append(item)
+            else:
+                print(f"Could not add {os.path.basename(file_path)} to its playlist: {error}")
+                self.storage.add_video(video_id, video_title, playlist_id, file_path, 'playlist_failed')
+
+        with self.lock:
+            # Back to the front, so they stay ahead of later items in the same playlist
+            self.items[:0] = retry
+        if quota_exceeded and self.quota:
+            self.quota.exhaust()
+        return not quota_exceeded
+
+def create_playlists(youtube, playlist_names, storage, catalogue, quota=None, profiles=None):
+    # Create the playlists that don't exist yet, PLAYLIST_BATCH_SIZE per request
+    if profiles is not None:
+        # Each channel's through the profile of that channel with the most quota left
+        channels = {}
+        for name in playlist_names:
+            channels.setdefault(profiles.channel_for(name), []).append(name)
+        for names in channels.values():
+            for start in range(0, len(names), PLAYLIST_BATCH_SIZE):
+                batch = names[start:start + PLAYLIST_BATCH_SIZE]
+                profile = profiles.pick(batch[0], QUOTA_COSTS['playlists.insert'] * len(batch))
+                create_playlists(profile.service(), batch, storage, profile.catalogue, profile.quota)
+        return
+    missing = [name for name in playlist_names
+               if not storage.get_playlist(name, catalogue.channel) and not catalogue.get(youtube, name)]
+    for start in range(0, len(missing), PLAYLIST_BATCH_SIZE):
+        names = missing[start:start + PLAYLIST_BATCH_SIZE]
+        if quota:
+            quota.reserve(QUOTA_COSTS['playlists.insert'] * len(names), f"creating {len(names)} playlists")
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                storage.add_playlist(response['id'], response['snippet']['title'], catalogue.channel)
+                catalogue.add(response['id'], response['snippet']['title'])
+            else:
+                print(f"Could not create playlist {names[int(request_id)]}: {exception}")
+
+        request = youtube.new_batch_http_request(callback=callback)
+        for i, name in enumerate(names):
+            request.add(youtube.playlists().insert(
+                part="snippet,status",
+                body={
+                    "snippet": {
+                        "title": name
+                    },
+                    "status": {
+                        "privacyStatus": "private"
+                    }
+                }
+            ), request_id=str(i))
+        execute_with_retry(request)
+
+def fingerprint_file(file_path, full_hash=False):
+    # Size plus a hash of evenly spaced samples, which is enough to spot copies of
+    # a video without reading all of it. Optionally also a hash of every byte.
+    file_stat = os.stat(file_path)
+    size = file_stat.st_size
+    sample_hash = hashlib.blake2b(str(size).encode(), digest_size=16)
+    file_hash = hashlib.blake2b(digest_size=32) if full_hash else None
+    if size:
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            with memoryview(data) as view:
+                step = max(size - FINGERPRINT_SAMPLE_SIZE, 0) / max(FINGERPRINT_SAMPLES - 1, 1)
+                for i in range(FINGERPRINT_SAMPLES):
+                    offset = int(i * step)
+                    check_file_size(f, size, file_path)
+                    sample_hash.update(view[offset:offset + FINGERPRINT_SAMPLE_SIZE])
+                if file_hash:
+                    for offset in range(0, size, FINGERPRINT_SAMPLE_SIZE * 8):
+                        check_file_size(f, size, file_path)
+                        file_hash.update(view[offset:offset + FINGERPRINT_SAMPLE_SIZE * 8])
+    return (file_path, size, file_stat.st_mtime, sample_hash.hexdigest(),
+            file_hash.hexdigest() if file_hash else None)
+
+def fingerprint_files(file_paths, storage, full_hash=False, executor=None):
+    # Fingerprints by path. Files whose size and mtime match the stored fingerprint
+    # are not read again; the rest are hashed on the executor's processes if given.
+    fingerprints = {}
+    stale = []
+    for file_path in file_paths:
+        file_stat = os.stat(file_path)
+        cached = storage.get_fingerprint(file_path)
+        if (cached and cached[0] == file_stat.st_size and cached[1] == file_stat.st_mtime
+                and (cached[3] or not full_hash)):
+            fingerprints[file_path] = cached
+        else:
+            stale.append(file_path)
+
+    if executor and len(stale) > 1:
+        results = list(executor.map(fingerprint_file, stale, [full_hash] * len(stale), chunksize=8))
+    else:
+        results = [fingerprint_file(file_path, full_hash) for file_path in stale]
+    storage.add_fingerprints(results)
+    for file_path, size, mtime, sample_hash, file_hash in results:
+        fingerprints[file_path] = (size, mtime, sample_hash, file_hash)
+    return fingerprints
+
+def add_to_playlist(youtube, playlist_id, video_id):
+    playlist_request = youtube.playlistItems().insert(
+        part="snippet",
+        body={
+            "snippet": {
+                "playlistId": playlist_id,
+                "resourceId": {
+                    "kind": "youtube#video",
+                    "videoId": video_id
+                }
+            }
+        }
+    )
+    execute_with_retry(playlist_request)
+
+class ChunkSizer:
+    # Picks the size of the next chunk from how the last ones went: aiming for
+    # chunks of about target_seconds, so fast links make few round trips and a
+    # failed chunk on a slow link costs little to send again. Sizes change by
+    # at most 2x per chunk and stay multiples of UPLOAD_CHUNK_ALIGNMENT.
+    def __init__(self, min_size=CHUNK_SIZE_MIN, max_size=CHUNK_SIZE_MAX, target_seconds=CHUNK_TARGET_SECONDS):
+        self.min_size = self._align(min_size)
+        self.max_size = max(self._align(max_size), self.min_size)
+        self.target_seconds = target_seconds
+        self.size = min(max(CHUNK_SIZE_INITIAL, self.min_size), self.max_size)
+
+    def _align(self, size):
+        return max(int(size) // UPLOAD_CHUNK_ALIGNMENT, 1) * UPLOAD_CHUNK_ALIGNMENT
+
+    def record(self, nbytes, seconds):
+        # Only full chunks say anything about the link; the last one is usually short
+        if nbytes < self.size or seconds <= 0:
+            return
+        ideal = nbytes / seconds * self.target_seconds
+        ideal = min(max(ideal, self.size / 2), self.size * 2)
+        self.size = min(max(self._align(ideal), self.min_size), self.max_size)
+
+    def failed(self):
+        self.size = max(self._align(self.size // 2), self.min_size)
+
+class UploadStats:
+    # What happened to one upload: the size, duration and throughput of every chunk sent
+    def __init__(self, file_path, size):
+        self.file_path = file_path
+        self.size = size
+        self.started = time.monotonic()
+        self.finished = None
+        self.chunks = []  # (chunk_size, bytes_sent, seconds)
+        self.retries = 0
+
+    def record(self, chunk_size, nbytes, seconds):
+        self.chunks.append((chunk_size, nbytes, seconds))
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def bytes_sent(self):
+        return sum(chunk[1] for chunk in self.chunks)
+
+    def throughput(self):
+        seconds = sum(chunk[2] for chunk in self.chunks)
+        return self.bytes_sent() / seconds if seconds else 0
+
+    def eta(self, remaining_bytes):
+        # Seconds left at the throughput measured so far, or None before the first chunk
+        throughput = self.throughput()
+        return remaining_bytes / throughput if throughput else None
+
+    def chunk_sizes(self):
+        return [chunk[0] for chunk in self.chunks]
+
+    def summary(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        sizes = self.chunk_sizes() or [0]
+        return (f"{os.path.basename(self.file_path)}: {self.bytes_sent() / 1024 ** 2:.1f} MiB in {elapsed:.1f} s, "
+                f"{self.throughput() / 1024 ** 2:.2f} MiB/s, {len(self.chunks)} chunks of "
+                f"{min(sizes) / 1024 ** 2:g}-{max(sizes) / 1024 ** 2:g} MiB, {self.retries} retries")
+
+class CircuitBreaker:
+    # Shared by all workers. After threshold retryable failures in a row, from
+    # any worker, the API is taken to be down and every worker holds off for
+    # cooldown seconds. The first failure after that opens it again straight
+    # away; any request that gets through closes it.
+    def __init__(self, threshold=CIRCUIT_BREAKER_THRESHOLD, cooldown=CIRCUIT_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.failures = 0
+        self.open_until = 0
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            now = time.monotonic()
+            if self.failures >= self.threshold and now >= self.open_until:
+                self.open_until = now + self.cooldown
+                print(f"{self.failures} failed requests in a row; pausing all uploads for {self.cooldown} seconds.")
+
+    def wait(self):
+        # Returns False if stopped while waiting
+        while True:
+            with self.lock:
+                remaining = self.open_until - time.monotonic()
+            if remaining <= 0:
+                return not self.stop_event.is_set()
+            if self.stop_event.wait(remaining):
+                return False
+
+    def stop(self):
+        self.stop_event.set()
+
+class RetryPolicy:
+    # Which upload errors are worth retrying, and how long to back off: exponential
+    # with full jitter, so workers that failed together don't retry together.
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 breaker=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.stop_event = threading.Event()
+
+    def is_retryable(self, error):
+        from googleapiclient.errors import HttpError
+        from httplib2 import HttpLib2Error
+
+        if isinstance(error, HttpError):
+            return error.resp.status in RETRYABLE_STATUSES
+        return isinstance(error, RETRYABLE_ERRORS + (HttpLib2Error,))
+
+    def wait(self):
+        if self.breaker:
+            return self.breaker.wait()
+        return not self.stop_event.is_set()
+
+    def succeeded(self):
+        if self.breaker:
+            self.breaker.record_success()
+
+    def failed(self, attempt):
+        # Returns how long to wait before the given retry
+        if self.breaker:
+            self.breaker.record_failure()
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def sleep(self, delay):
+        return not self.stop_event.wait(delay)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.breaker:
+            self.breaker.stop()
+
+def error_name(error):
+    # A short label for metrics: the HTTP status for API errors, else the exception type
+    from googleapiclient.errors import HttpError
+
+    if isinstance(error, HttpError):
+        return f"http_{error.resp.status}"
+    return type(error).__name__
+
+def execute_with_retry(request, retry_policy=None):
+    # request.execute(), retried on the same errors as upload chunks
+    retry_policy = retry_policy or RetryPolicy()
+    attempt = 0
+    while True:
+        try:
+            metrics.inc('youtube_uploader_api_calls_total', method=getattr(request, 'methodId', 'batch'))
+            response = request.execute()
+            retry_policy.succeeded()
+            return response
+        except Exception as e:
+            if not retry_policy.is_retryable(e) or attempt + 1 >= retry_policy.max_attempts:
+                raise
+            attempt += 1
+            metrics.inc('youtube_uploader_retries_total', error=error_name(e))
+            delay = retry_policy.failed(attempt)
+            print(f"{e!r}; retrying in {delay:.1f} s (attempt {attempt} of {retry_policy.max_attempts - 1})")
+            if not retry_policy.sleep(delay):
+                raise
+
+def record_upload(stats):
+    seconds = stats.finished - stats.started
+    metrics.inc('youtube_uploader_uploads_total', outcome='uploaded')
+    metrics.observe('youtube_uploader_upload_seconds', seconds)
+    metrics.event('upload', file=stats.file_path, size=stats.size, bytes_sent=stats.bytes_sent(),
+                  seconds=round(seconds, 3), throughput=round(stats.throughput()), chunks=len(stats.chunks),
+                  retries=stats.retries)
+
+def resume_upload_session(request, storage, file_path, size, mtime):
+    # Point a fresh insert request at the session stored by an earlier run, if the
+    # server still has it. Returns the video resource when that upload had already finished.
+    session = storage.get_upload_session(file_path)
+    if not session:
+        return None
+
+    session_uri, _, stored_size, stored_mtime = session
+    if stored_size != size or stored_mtime != mtime:
+        # The file changed since the session started, so the uploaded bytes are stale
+        storage.delete_upload_session(file_path)
+        return None
+
+    # An empty PUT asks the server how much of the session it has committed
+    resp, content = request.http.request(session_uri, 'PUT', headers={
+        'Content-Length': '0',
+        'Content-Range': f'bytes */{size}',
+    })
+    if resp.status in (200, 201):
+        return request.postproc(resp, content)
+    if resp.status != 308:
+        # Sessions expire after about a week; start over with a new one
+        storage.delete_upload_session(file_path)
+        return None
+
+    request.resumable_uri = resp.get('location', session_uri)
+    request.resumable_progress = int(resp['range'].split('-')[1]) + 1 if 'range' in resp else 0
+    print(f"Resuming {os.path.basename(file_path)} from byte {request.resumable_progress} of {size}")
+    return None
+
+def upload_video(youtube, file_path, playlist_id, storage, update_file_progress=None, playlist_turn=None,
+                 dedupe='link', full_hash=False, quota=None, playlist_queue=None, bandwidth=None,
+                 chunk_sizes=(CHUNK_SIZE_MIN, CHUNK_SIZE_MAX), stats=None, retry_policy=None, engine=None,
+                 channel=None):
+    if engine is not None:
+        # Another upload engine, such as async_uploader.AsyncUploadPool, does the whole upload with its own settings
+        return engine.submit(file_path, playlist_id).result()
     try:
         stored_video = storage.get_video(file_path)
     except:
@@ -160,6 +1501,7 @@ def upload_video(youtube, file_path, playlist_id, storage, update_file_progress)
     
     if stored_video:
         print(f"Video {os.path.basename(file_path)} already uploaded. Skipping.")
+        metrics.inc('youtube_uploader_uploads_total', outcome='skipped')
         return stored_video[0], stored_video[1], stored_video[2]
     
     video_title = os.path.splitext(os.path.basename(file_path))[0]
@@ -169,125 +1511,839 @@ def upload_video(youtube, file_path, playlist_id, storage, update_file_progress)
         storage.add_video(video_id, video_title, playlist_id, file_path, 'dry_run')
         return video_id, video_title, playlist_id
 
-    for attempt in range(max_retries):
+    if dedupe != 'off':
+        size, _, sample_hash, file_hash = fingerprint_files([file_path], storage, full_hash)[file_path]
+        # Only a copy on the playlist's own channel will do
+        duplicate = storage.find_video_by_fingerprint(size, sample_hash, file_hash, channel)
+        if duplicate:
+            video_id, video_title, duplicate_playlist_id = duplicate[0], duplicate[1], duplicate[2]
+            print(f"Video {os.path.basename(file_path)} is a copy of {duplicate[3]}, already uploaded as {video_id}.")
+            metrics.inc('youtube_uploader_uploads_total', outcome='duplicate')
+            if dedupe == 'link' and duplicate_playlist_id != playlist_id:
+                if quota:
+                    quota.reserve(QUOTA_COSTS['playlistItems.insert'], f"adding {file_path} to a playlist")
+                if playlist_turn:
+                    playlist_turn()
+                if playlist_queue is not None:
+                    playlist_queue.put(playlist_id, video_id, video_title, file_path)
+                    return video_id, video_title, playlist_id
+                add_to_playlist(youtube, playlist_id, video_id)
+            else:
+                playlist_id = duplicate_playlist_id
+            storage.add_video(video_id, video_title, playlist_id, file_path, 'uploaded')
+            return video_id, video_title, playlist_id
+
+    if quota:
+        # Only start an upload when today's budget also covers adding it to the playlist
+        quota.reserve(UPLOAD_QUOTA_COST, f"uploading {file_path}")
+
+    sizer = ChunkSizer(*chunk_sizes)
+    retry_policy = retry_policy or RetryPolicy()
+    file_stat = os.stat(file_path)
+    if stats is None:
+        stats = UploadStats(file_path, file_stat.st_size)
+    from googleapiclient.errors import HttpError
+    from mapped_media import MappedMediaUpload
+
+    media = MappedMediaUpload(file_path, chunksize=sizer.size)
+    request = youtube.videos().insert(
+        part="snippet,status",
+        body={
+            'snippet': {
+                'title': video_title,
+                'description': 'Uploaded using bulk uploader script',
+                "tags": ["bulk", "uploader", "youtube"],
+                "categoryId": "22",
+            },
+            'status': {
+                'privacyStatus': 'unlisted',
+            }
+        },
+        media_body=media
+    )
+    response = resume_upload_session(request, storage, file_path, file_stat.st_size, file_stat.st_mtime)
+    attempt = 0  # Failures in a row; reset by every chunk that gets through
+    while response is None:
+        chunk_size = sizer.size
+        if bandwidth and bandwidth.chunk_size():
+            chunk_size = min(chunk_size, bandwidth.chunk_size())
+        media.set_chunksize(chunk_size)
+        sending = min(chunk_size, media.size() - request.resumable_progress)
+        if not retry_policy.wait() or (bandwidth and not bandwidth.acquire(sending)):
+            # Cancelled; the saved session lets the next run pick up from here
+            media.close()
+            return None, None, None
         try:
-            media = MediaFileUpload(file_path, resumable=True)
-            request = youtube.videos().insert(
-                part="snippet,status",
-                body={
-                    'snippet': {
-                        'title': video_title,
-                        'description': 'Uploaded using bulk uploader script',
-                        "tags": ["bulk", "uploader", "youtube"],
-                        "categoryId": "22",
-                    },
-                    'status': {
-                        'privacyStatus': 'unlisted',
-                    }
-                },
-                media_body=media
-            )
-            response = None
-            while response is None:
+            offset = request.resumable_progress
+            started = time.monotonic()
+            metrics.inc('youtube_uploader_api_calls_total', method='youtube.videos.insert')
+            status, response = request.next_chunk()
+            seconds = time.monotonic() - started
+            retry_policy.succeeded()
+            attempt = 0
+            sizer.record(sending, seconds)
+            stats.record(chunk_size, sending, seconds)
+            metrics.sent(sending, seconds)
+            metrics.event('chunk', file=file_path, offset=offset, bytes=sending, chunk_size=chunk_size,
+                          seconds=round(seconds, 4))
+            if response is None and request.resumable_uri:
+                storage.save_upload_session(file_path, request.resumable_uri, request.resumable_progress,
+                                            file_stat.st_size, file_stat.st_mtime)
+            if status and update_file_progress:
+                progress = int(status.progress() * 100)  # Progress in percentage
+                remaining_time = stats.eta(status.total_size - status.resumable_progress)  # Seconds, -1 if unknown
+                update_file_progress.emit(playlist_id, file_path, progress,
+                                          -1 if remaining_time is None else remaining_time)
+        except Exception as e:
+            if isinstance(e, HttpError) and is_quota_error(e):
+                media.close()
+                raise QuotaExceededError("YouTube API quota has been exceeded. Please try again later.")
+            if not retry_policy.is_retryable(e) or attempt + 1 >= retry_policy.max_attempts:
+                media.close()
+                raise
+            attempt += 1
+            sizer.failed()
+            stats.retries += 1
+            metrics.inc('youtube_uploader_retries_total', error=error_name(e))
+            delay = retry_policy.failed(attempt)
+            print(f"{os.path.basename(file_path)}: {e!r}; retrying in {delay:.1f} s "
+                  f"(attempt {attempt} of {retry_policy.max_attempts - 1})")
+            if not retry_policy.sleep(delay):
+                media.close()
+                return None, None, None
+            # Ask the server how far it got before sending more. The client library
+            # already does this after an HTTP error, but not after a socket error.
+            request._in_error_state = True
+        finally:
+            media.release()
+    media.close()
+    video_id = response['id']
+    video_title = response.get("snippet")["title"]
+    stats.finish()
+    print(f"Uploaded {stats.summary()}")
+    record_upload(stats)
+
+    # Wait until the videos queued before this one are in the playlist
+    if playlist_turn:
+        playlist_turn()
+    if playlist_queue is not None:
+        playlist_queue.put(playlist_id, video_id, video_title, file_path)
+    else:
+        add_to_playlist(youtube, playlist_id, video_id)
+        storage.add_video(video_id, video_title, playlist_id, file_path, 'uploaded')
+    storage.delete_upload_session(file_path)
+    return video_id, video_title, playlist_id
+
+class PlaylistSequencer:
+    # Uploads may finish in any order, but each playlist gets its videos
+    # attached in the order they were queued.
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._issued = {}    # playlist_id -> next ticket to hand out
+        self._next = {}      # playlist_id -> ticket allowed to attach next
+        self._finished = {}  # playlist_id -> tickets finished out of turn
+
+    def ticket(self, playlist_id):
+        with self._condition:
+            index = self._issued.get(playlist_id, 0)
+            self._issued[playlist_id] = index + 1
+            return index
+
+    def wait_turn(self, playlist_id, index):
+        with self._condition:
+            self._condition.wait_for(lambda: self._next.get(playlist_id, 0) >= index)
+
+    def finish(self, playlist_id, index):
+        with self._condition:
+            finished = self._finished.setdefault(playlist_id, set())
+            finished.add(index)
+            next_index = self._next.get(playlist_id, 0)
+            while next_index in finished:
+                finished.remove(next_index)
+                next_index += 1
+            self._next[playlist_id] = next_index
+            self._condition.notify_all()
+
+class UploadWorkerPool:
+    def __init__(self, storage, workers=1, service_factory=get_authenticated_service,
+                 update_file_progress=None, gate=None, dedupe='link', full_hash=False, quota=None,
+                 batch_playlists=True, bandwidth=None, chunk_sizes=(CHUNK_SIZE_MIN, CHUNK_SIZE_MAX), profiles=None):
+        self.storage = storage
+        self.quota = quota
+        self.profiles = profiles  # a CredentialPool, used instead of service_factory and quota
+        self.bandwidth = bandwidth
+        self.chunk_sizes = chunk_sizes
+        self.retry_policy = RetryPolicy(breaker=CircuitBreaker())
+        self.stats = {}  # file_path -> UploadStats of uploads started by this pool
+        # With profiles, each attachment goes through the channel and quota of the profile that uploaded
+        self.playlist_queue = PlaylistItemQueue(storage, quota) if batch_playlists and profiles is None else None
+        self.dedupe = dedupe
+        self.full_hash = full_hash
+        self.workers = max(1, workers)
+        self.service_factory = service_factory
+        self.update_file_progress = update_file_progress
+        self.gate = gate  # called before each upload, returns False to skip it
+        self.sequencer = PlaylistSequencer()
+        self.stop_event = threading.Event()
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='uploader')
+
+    def service(self):
+        # httplib2 clients are not thread safe, so every worker has its own
+        youtube = getattr(self._local, 'youtube', None)
+        if youtube is None:
+            youtube = self._local.youtube = self.service_factory()
+        return youtube
+
+    def submit(self, file_path, playlist_id):
+        index = self.sequencer.ticket(playlist_id)
+        return self._executor.submit(self._upload, file_path, playlist_id, index)
+
+    def _upload(self, file_path, playlist_id, index):
+        try:
+            while True:
+                if self.stop_event.is_set() or (self.gate and not self.gate()):
+                    return None, None, None
+                quota, profile = self.quota, None
                 try:
-                    status, response = request.next_chunk()
-                    if status:
-                        progress = int(status.progress() * 100)  # Progress in percentage
-                        remaining_time = (status.total_size - status.resumable_progress) / 1024  # Estimated time in KB
-                        update_file_progress.emit(playlist_id, file_path, progress, remaining_time)
-                except HttpError as e:
-                    if e.resp.status == 403 and 'quotaExceeded' in [i["reason"] for i in e.error_details]:
-                        raise QuotaExceededError("YouTube API quota has been exceeded. Please try again later.")
+                    if file_path not in self.stats and os.path.exists(file_path):
+                        self.stats[file_path] = UploadStats(file_path, os.path.getsize(file_path))
+                    if self.profiles is not None:
+                        profile = self.profiles.pick_for_id(playlist_id, UPLOAD_QUOTA_COST)
+                        quota = profile.quota
+                        profile.refresh()
+                        youtube = profile.service()
                     else:
-                        raise e  # Re-raise other exceptions
-            video_id = response['id']
-            video_title = response.get("snippet")["title"]
+                        refresh_credentials()
+                        youtube = self.service()
+                    result = upload_video(youtube, file_path, playlist_id, self.storage,
+                                          self.update_file_progress,
+                                          playlist_turn=lambda: self.sequencer.wait_turn(playlist_id, index),
+                                          dedupe=self.dedupe, full_hash=self.full_hash, quota=quota,
+                                          playlist_queue=self.playlist_queue, bandwidth=self.bandwidth,
+                                          chunk_sizes=self.chunk_sizes, stats=self.stats.get(file_path),
+                                          retry_policy=self.retry_policy,
+                                          channel=profile.channel if profile is not None else None)
+                    if self.playlist_queue is not None:
+                        self.playlist_queue.flush(self.service())
+                    return result
+                except QuotaExceededError:
+                    if profile is not None and not self.profiles.stop_event.is_set():
+                        if profile.quota.remaining() >= UPLOAD_QUOTA_COST:
+                            # Refused by the API although the count had room: this project is done for today
+                            profile.quota.exhaust()
+                        # Picked again, from the channel's other profiles or after the reset
+                        continue
+                    if not self.quota or not self.quota.wait_for_reset or self.quota.stop_event.is_set():
+                        raise
+                    # Something else used up the project's quota. Try again after the reset;
+                    # the stored session lets the upload continue where it stopped.
+                    self.quota.exhaust()
+        except Exception as e:
+            metrics.inc('youtube_uploader_uploads_total', outcome='failed')
+            metrics.event('failed', file=file_path, error=repr(e))
+            raise
+        finally:
+            self.sequencer.finish(playlist_id, index)
 
-            playlist_request = youtube.playlistItems().insert(
-                part="snippet",
-                body={
-                    "snippet": {
-                        "playlistId": playlist_id,
-                        "resourceId": {
-                            "kind": "youtube#video",
-                            "videoId": video_id
-                        }
-                    }
-                }
-            )
-            playlist_request.execute()
+    def cancel(self):
+        self.stop_event.set()
+        if self.quota:
+            self.quota.stop()
+        if self.profiles:
+            self.profiles.stop()
+        if self.bandwidth:
+            self.bandwidth.stop()
+        self.retry_policy.stop()
+        # Queued uploads see the stop event and return at once. Futures cancelled by the
+        # executor instead would never wake a caller already waiting in as_completed.
 
-            storage.add_video(video_id, video_title, playlist_id, file_path, 'uploaded')
-            return video_id, video_title, playlist_id
+    def flush_playlists(self):
+        # Send queued playlist attachments now instead of waiting for a full batch.
+        # Returns False if the quota ran out; the rest stay pending.
+        if self.playlist_queue is not None and len(self.playlist_queue):
+            return self.playlist_queue.flush(self.service(), final=True)
+        return True
 
-        except (SSLEOFError, HttpError, ResumableUploadError) as e:
-            if isinstance(e, (HttpError, ResumableUploadError)):
-                if e.resp.status == 403 and 'quotaExceeded' in e._get_reason():
-                    raise QuotaExceededError("YouTube API quota has been exceeded. Please try again later.")
-                
-                else:
-                    raise Exception(f"An error occurred: {e}")
-                if getattr(e, 'resp', {}).get('status') not in [500, 502, 503, 504]:
-                    print("Client error. Upload failed.")
-                    raise
-            elif isinstance(e, SSLEOFError):
-                print(f"SSLEOFError occurred: {e}")
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        # Whatever is left goes out now; anything the quota won't allow stays pending for the next run
+        if not self.flush_playlists():
+            print(f"{len(self.playlist_queue)} videos are still waiting to be added to playlists.")
 
-            if attempt < max_retries - 1:
-                print(f"Retrying in {retry_delay} seconds... (Attempt {attempt + 1 } of {max_retries})")
-                time.sleep(retry_delay)
-                retry_delay *= 2  # Exponential backoff
-            else:
-                print("Max retries reached. Upload failed.")
-                raise
+def scan_directory(root_dir, manifest_file=None):
+    # List every video under root_dir in one os.scandir pass, as
+    # (playlist_name, path, size, mtime) in walk order. With a manifest file the
+    # listing is saved, and the next scan reuses it for every directory whose
+    # mtime hasn't changed (adding, removing or renaming a file changes it).
+    started = time.perf_counter()
+    previous = {}
+    if manifest_file and os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('root') == root_dir:
+            previous = manifest['dirs']
+
+    entries, dirs = _list_directories(root_dir, previous)
 
-    return None, None, None  # If all retries fail
+    if manifest_file:
+        temp_filename = manifest_file + '.tmp'
+        with open(temp_filename, 'w') as f:
+            json.dump({'root': root_dir, 'dirs': dirs}, f)
+        os.replace(temp_filename, manifest_file)
+    seconds = time.perf_counter() - started
+    metrics.observe('youtube_uploader_scan_seconds', seconds)
+    metrics.event('scan', root=root_dir, videos=len(entries), directories=len(dirs), seconds=round(seconds, 4))
+    return entries
 
-def process_directory(youtube, root_dir, storage, dry_run=False):
-    for dirpath, dirnames, filenames in os.walk(root_dir):
-        rel_path = os.path.relpath(dirpath, root_dir)
-        if rel_path == '.':
+def _list_directories(root_dir, previous):
+    # previous: directory listings from an earlier pass, reused where the mtime matches
+    dirs = {}
+    entries = []
+    pending = [root_dir]
+    while pending:
+        dirpath = pending.pop()
+        try:
+            dir_mtime = os.stat(dirpath).st_mtime
+        except OSError:
             continue
 
-        playlist_name = '_'.join(rel_path.split(os.path.sep))
-        video_files = [f for f in filenames if f.endswith(('.mp4', '.avi', '.mov', '.mkv', '.m4v'))]
-
-        if video_files:
-            print(f"Playlist: {playlist_name}")
-            for video in video_files:
-                print(f"  - {video}")
-            print()
-            
-            if dry_run:
-                playlist_id = f"DRY_RUN_PLAYLIST_{playlist_name}"
-                for video in video_files:
-                    video_path = os.path.join(dirpath, video)
-                    video_title = os.path.splitext(video)[0]
-                    storage.add_dry_run_video(video_title, playlist_id, video_path)
-                    print(f"Dry run: Processed {video} in playlist {playlist_name}")
-            else:
-                playlist_id = create_or_get_playlist(youtube, playlist_name, storage)
-                for video in video_files:
-                    video_path = os.path.join(dirpath, video)
-                    upload_video(youtube, video_path, playlist_id, storage)
-                    print(f"Processed {video} in playlist {playlist_name}")
+        listing = previous.get(dirpath)
+        if listing is None or listing['mtime'] != dir_mtime:
+            listing = {'mtime': dir_mtime, 'subdirs': [], 'videos': []}
+            try:
+                with os.scandir(dirpath) as scan:
+                    for entry in scan:
+                        if entry.is_dir(follow_symlinks=False):
+                            listing['subdirs'].append(entry.name)
+                        elif entry.name.endswith(VIDEO_EXTENSIONS) and entry.is_file():
+                            entry_stat = entry.stat()
+                            listing['videos'].append([entry.name, entry_stat.st_size, entry_stat.st_mtime])
+            except OSError:
+                continue
+            listing['subdirs'].sort()
+            listing['videos'].sort()
+            if time.time() - dir_mtime < 2:
+                # Too recent to trust: a change in the same mtime tick would go unnoticed
+                listing['mtime'] = None
+        dirs[dirpath] = listing
+
+        playlist_name = playlist_name_for(root_dir, dirpath)
+        if playlist_name is not None:
+            for name, size, mtime in listing['videos']:
+                entries.append((playlist_name, os.path.join(dirpath, name), size, mtime))
+        pending.extend(os.path.join(dirpath, name) for name in reversed(listing['subdirs']))
+    return entries, dirs
+
+def playlist_name_for(root_dir, dirpath):
+    # Videos directly in root_dir belong to no playlist
+    rel_path = os.path.relpath(dirpath, root_dir)
+    return None if rel_path == '.' else '_'.join(rel_path.split(os.path.sep))
+
+def group_by_playlist(entries):
+    playlists = {}
+    for entry in entries:
+        playlists.setdefault(entry[0], []).append(entry)
+    return playlists
+
+def _upload_pool(youtube, storage, workers, dedupe, full_hash, quota, bandwidth, chunk_sizes, engine,
+                 service_factory, batch_playlists=True, profiles=None):
+    if engine == 'asyncio':
+        if profiles is not None:
+            raise ValueError("Credential profiles need the threads engine")
+        from async_uploader import AsyncUploadPool
+        return AsyncUploadPool.from_service(youtube, storage, workers=workers, dedupe=dedupe, full_hash=full_hash,
+                                            quota=quota, bandwidth=bandwidth, chunk_sizes=chunk_sizes,
+                                            batch_playlists=batch_playlists)
+    return UploadWorkerPool(storage, workers, service_factory=service_factory, dedupe=dedupe,
+                            full_hash=full_hash, quota=quota, bandwidth=bandwidth, chunk_sizes=chunk_sizes,
+                            batch_playlists=batch_playlists, profiles=profiles)
+
+class LeaseKeeper:
+    # Heartbeats for the files a node has claimed from the shared job queue:
+    # renews all of its leases every third of the lease time until stopped.
+    def __init__(self, storage, owner, lease_seconds=JOB_LEASE_SECONDS):
+        self.storage = storage
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lease-keeper', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self.stop_event.wait(self.lease_seconds / 3):
+            try:
+                self.storage.renew_leases(self.owner, self.lease_seconds)
+            except sqlite3.Error as e:
+                # The next heartbeat may get through before the leases run out
+                print(f"Could not renew leases: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        self._thread.join()
+
+@contextlib.contextmanager
+def _shared_lock(storage, name, owner, seconds=JOB_LEASE_SECONDS):
+    # Held across processes and machines sharing the storage, e.g. while playlists are
+    # created so nodes starting together don't each create the same ones
+    while not storage.acquire_lock(name, owner, seconds):
+        time.sleep(JOB_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        storage.release_lock(name, owner)
+
+def _drain_job_queue(youtube, storage, pool, workers, owner, playlist_ids, catalogue, quota, hasher, full_hash,
+                     profiles=None, lease_seconds=JOB_LEASE_SECONDS):
+    # Upload files claimed from the shared queue, a few at a time so other nodes get the
+    # rest, until none are left. Files leased by other nodes are waited for, in case a
+    # node dies and its leases run out.
+    leases = LeaseKeeper(storage, owner, lease_seconds)
+    uploads = {}
+    done = 0
+    try:
+        while True:
+            if len(uploads) < workers:
+                jobs = []
+                for job in storage.claim_jobs(owner, workers * 2 - len(uploads), lease_seconds):
+                    if os.path.exists(job[0]):
+                        jobs.append(job)
+                    else:
+                        # Deleted or moved since it was queued; left in the queue it would stop every node
+                        print(f"{job[0]} no longer exists. Skipping.")
+                        storage.finish_job(job[0], owner, 'failed')
+                if hasher:
+                    try:
+                        fingerprint_files([job[0] for job in jobs if not storage.get_video(job[0])], storage,
+                                          full_hash, hasher)
+                    except (FileNotFoundError, FileChangedError):
+                        # Gone or changed since the check above; its upload fails on its own below
+                        pass
+                for file_path, playlist_name, _ in jobs:
+                    if playlist_name not in playlist_ids:
+                        # Queued by another node that found files this one didn't
+                        with _shared_lock(storage, 'playlists', owner):
+                            playlist_ids[playlist_name] = create_or_get_playlist(youtube, playlist_name, storage,
+                                                                                 catalogue, quota, profiles)
+                    uploads[pool.submit(file_path, playlist_ids[playlist_name])] = (file_path, playlist_name)
+            if not uploads:
+                leased = storage.count_jobs('leased')
+                if not leased:
+                    break
+                print(f"Waiting for {leased} files being uploaded by other nodes")
+                time.sleep(JOB_POLL_INTERVAL)
+                continue
+
+            finished, _ = wait(uploads, return_when=FIRST_COMPLETED)
+            for future in finished:
+                file_path, playlist_name = uploads.pop(future)
+                try:
+                    video_id, _, _ = future.result()
+                except QuotaExceededError:
+                    raise
+                except (FileNotFoundError, FileChangedError) as e:
+                    print(f"Skipping {file_path}: {e}")
+                    storage.finish_job(file_path, owner, 'failed')
+                    continue
+                except Exception:
+                    storage.finish_job(file_path, owner, 'failed')
+                    raise
+                # Without a video id the upload was cancelled, so the file goes back to the queue
+                storage.finish_job(file_path, owner, 'done' if video_id else 'queued')
+                done += 1
+                print(f"Processed {os.path.basename(file_path)} in playlist {playlist_name} "
+                      f"({done} on this node, {storage.count_jobs('queued')} queued)")
+    finally:
+        leases.stop()
+        storage.release_jobs(owner)
+
+def _round_robin(entries):
+    # One video from each playlist in turn, each playlist in walk order
+    rounds = zip_longest(*group_by_playlist(entries).values())
+    return [entry for entries_in_round in rounds for entry in entries_in_round if entry is not None]
+
+# Upload orders by name. Each takes and returns (playlist_name, path, size, mtime) entries.
+SCHEDULE_POLICIES = {
+    'walk': list,
+    'shortest': lambda entries: sorted(entries, key=lambda entry: entry[2]),
+    'oldest': lambda entries: sorted(entries, key=lambda entry: entry[3]),
+    'round-robin': _round_robin,
+}
+
+def load_priorities(priorities_file):
+    # A JSON object of glob patterns and numbers, e.g. {"lectures_*": 10, "raw/*.mkv": -5}.
+    # Patterns match playlist names or paths relative to the root directory.
+    with open(priorities_file, 'r') as f:
+        priorities = json.load(f)
+    if not isinstance(priorities, dict) or not all(isinstance(value, (int, float)) for value in priorities.values()):
+        raise ValueError(f"{priorities_file} should map patterns to numbers")
+    return priorities
+
+def schedule_uploads(entries, root_dir, policy='walk', priorities=None):
+    # Higher priorities go first, with the policy deciding the order within each priority
+    if not priorities:
+        return SCHEDULE_POLICIES[policy](entries)
+    levels = {}
+    for entry in entries:
+        rel_path = os.path.relpath(entry[1], root_dir).replace(os.path.sep, '/')
+        matches = [value for pattern, value in priorities.items()
+                   if fnmatch.fnmatchcase(entry[0], pattern) or fnmatch.fnmatchcase(rel_path, pattern)]
+        levels.setdefault(max(matches, default=0), []).append(entry)
+    return [entry for level in sorted(levels, reverse=True) for entry in SCHEDULE_POLICIES[policy](levels[level])]
+
+def process_directory(youtube, root_dir, storage, dry_run=False, workers=1, dedupe='link', full_hash=False,
+                      manifest_file=None, quota=None, bandwidth=None, chunk_sizes=(CHUNK_SIZE_MIN, CHUNK_SIZE_MAX),
+                      engine='threads', service_factory=get_authenticated_service, schedule='walk',
+                      priorities=None, job_queue=False, profiles=None):
+    # Videos are uploaded in the order the schedule policy and priorities give, and join
+    # their playlists in that order. With job_queue, the files go into the storage's shared
+    # queue and this process uploads whichever it claims; any number of processes, on any
+    # number of machines sharing the storage, can do the same.
+    if job_queue and storage.storage_type != 'sqlite':
+        raise ValueError("The shared job queue needs SQLite storage")
+    pool = None
+    if not dry_run:
+        # Playlist attachments aren't batched with a shared queue: a batch held back in
+        # one process would be sent again by any other that starts meanwhile
+        pool = _upload_pool(youtube, storage, workers, dedupe, full_hash, quota, bandwidth, chunk_sizes, engine,
+                            service_factory, batch_playlists=not job_queue, profiles=profiles)
+    # Fingerprints are hashed ahead of the uploads, on all cores
+    hasher = None if dry_run or dedupe == 'off' else ProcessPoolExecutor()
+    catalogue = PlaylistCatalogue(storage, quota=quota)
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    uploads = {}
+    try:
+        entries = scan_directory(root_dir, manifest_file)
+        playlists = group_by_playlist(entries)
+        total_bytes = sum(entry[2] for entry in entries)
+        print(f"Found {len(entries)} videos ({total_bytes / 1024 ** 3:.2f} GB) in {len(playlists)} playlists")
+        print()
+
+        playlist_ids = {}
+        with _shared_lock(storage, 'playlists', owner) if job_queue else contextlib.nullcontext():
+            if not dry_run:
+                create_playlists(youtube, list(playlists), storage, catalogue, quota, profiles)
+
+            for playlist_name, videos in playlists.items():
+                print(f"Playlist: {playlist_name}")
+                for _, video_path, _, _ in videos:
+                    print(f"  - {os.path.basename(video_path)}")
+                print()
+
+                if dry_run:
+                    playlist_id = f"DRY_RUN_PLAYLIST_{playlist_name}"
+                    for _, video_path, _, _ in videos:
+                        video = os.path.basename(video_path)
+                        video_title = os.path.splitext(video)[0]
+                        storage.add_dry_run_video(video_title, playlist_id, video_path)
+                        print(f"Dry run: Processed {video} in playlist {playlist_name}")
+                else:
+                    playlist_ids[playlist_name] = create_or_get_playlist(youtube, playlist_name, storage, catalogue,
+                                                                         quota, profiles)
+
+        scheduled = [] if dry_run else schedule_uploads(entries, root_dir, schedule, priorities)
+        if job_queue:
+            storage.enqueue_jobs([(video_path, playlist_name, size) for playlist_name, video_path, size, _ in scheduled])
+            _drain_job_queue(youtube, storage, pool, workers, owner, playlist_ids, catalogue, quota, hasher, full_hash,
+                             profiles)
+            scheduled = []
+        for start in range(0, len(scheduled), FINGERPRINT_BATCH_SIZE):
+            batch = scheduled[start:start + FINGERPRINT_BATCH_SIZE]
+            if hasher:
+                new_files = [video_path for _, video_path, _, _ in batch if not storage.get_video(video_path)]
+                try:
+                    fingerprint_files(new_files, storage, full_hash, hasher)
+                except (FileNotFoundError, FileChangedError):
+                    # A file deleted or still being written; its upload fails on its own below
+                    pass
+            for playlist_name, video_path, size, _ in batch:
+                uploads[pool.submit(video_path, playlist_ids[playlist_name])] = (os.path.basename(video_path),
+                                                                                 playlist_name, size)
+
+        remaining_bytes = sum(size for _, _, size in uploads.values())
+        for done, future in enumerate(as_completed(uploads), 1):
+            video, playlist_name, size = uploads[future]
+            remaining_bytes -= size
+            try:
+                future.result()
+            except (FileNotFoundError, FileChangedError) as e:
+                # Deleted or still being written; tried again on the next run
+                print(f"Skipping {video} in playlist {playlist_name}: {e}")
+                continue
+            eta = metrics.eta(remaining_bytes) if remaining_bytes else 0
+            print(f"Processed {video} in playlist {playlist_name} ({done}/{len(uploads)}, "
+                  f"{format_duration(eta)} left at {metrics.rate() / 1e6:.1f} MB/s)")
+    except BaseException:
+        # Don't start anything new after a failure such as an exceeded quota
+        if pool:
+            pool.cancel()
+        raise
+    finally:
+        if pool:
+            pool.shutdown()
+        if hasher:
+            hasher.shutdown()
+
+class DirectoryWatcher:
+    # Finds videos under root_dir, first those already there and then new ones
+    # as they appear, without rescanning the tree. With the optional watchdog
+    # package the operating system reports new files (inotify on Linux);
+    # without it, directories are polled and only those whose mtime changed
+    # are listed again. A file is ready once its size and mtime have stayed the
+    # same for settle seconds, so recordings still being written are left alone.
+    def __init__(self, root_dir, settle=WATCH_SETTLE_SECONDS, poll_interval=WATCH_POLL_INTERVAL, use_events=True):
+        self.root_dir = root_dir
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_events = use_events
+        self.lock = threading.Lock()
+        self.candidates = {}  # path -> (size, mtime) when last checked
+        self.seen = set()     # paths already found, ready or not
+        self.polling = False
+        self._observer = None
+        self._dirs = {}
+        self._listed_at = 0
+
+    def start(self):
+        if self.use_events:
+            # Started before the first listing, so nothing written in between is missed
+            try:
+                self._observer = self._start_observer()
+            except ImportError:
+                print("watchdog is not installed; polling for new videos instead.")
+        self.polling = self._observer is None
+        self._list()
+
+    def _start_observer(self):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.event_type in ('created', 'modified', 'moved', 'closed'):
+                    path = os.fsdecode(getattr(event, 'dest_path', '') or event.src_path)
+                    if event.is_directory:
+                        watcher._add_tree(path)
+                    else:
+                        watcher._add(path)
+
+        observer = Observer()
+        observer.schedule(Handler(), self.root_dir, recursive=True)
+        observer.start()
+        return observer
+
+    def _list(self):
+        entries, self._dirs = _list_directories(self.root_dir, self._dirs)
+        self._listed_at = time.monotonic()
+        for _, path, size, mtime in entries:
+            self._add(path, (size, mtime))
+
+    def _add_tree(self, dirpath):
+        # A directory moved in whole may bring videos no event was sent for
+        for dirpath, _, filenames in os.walk(dirpath):
+            for name in filenames:
+                self._add(os.path.join(dirpath, name))
+
+    def _add(self, path, listed=None):
+        # listed: (size, mtime) from a directory listing, so files that were already complete are ready at once
+        if not path.endswith(VIDEO_EXTENSIONS) or playlist_name_for(self.root_dir, os.path.dirname(path)) is None:
+            return
+        with self.lock:
+            if path not in self.seen:
+                self.seen.add(path)
+                self.candidates[path] = listed
+
+    def ready(self):
+        # Videos that have settled since the last call, as (playlist_name, path, size, mtime)
+        if self.polling and time.monotonic() - self._listed_at >= self.poll_interval:
+            self._list()
+        with self.lock:
+            candidates = list(self.candidates.items())
+        entries = []
+        for path, last in candidates:
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                # Gone again, e.g. a temporary file that was renamed; a new name is a new event
+                with self.lock:
+                    del self.candidates[path]
+                    self.seen.discard(path)
+                continue
+            current = (file_stat.st_size, file_stat.st_mtime)
+            if current == last and time.time() - file_stat.st_mtime >= self.settle:
+                with self.lock:
+                    del self.candidates[path]
+                entries.append((playlist_name_for(self.root_dir, os.path.dirname(path)), path) + current)
+            elif current != last:
+                with self.lock:
+                    self.candidates[path] = current
+        entries.sort()
+        return entries
+
+    def stop(self):
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+
+def watch_directory(youtube, root_dir, storage, workers=1, dedupe='link', full_hash=False, quota=None, bandwidth=None,
+                    chunk_sizes=(CHUNK_SIZE_MIN, CHUNK_SIZE_MAX), engine='threads',
+                    service_factory=get_authenticated_service, settle=WATCH_SETTLE_SECONDS,
+                    poll_interval=WATCH_POLL_INTERVAL, use_events=True, stop_event=None, schedule='walk',
+                    priorities=None, profiles=None):
+    # Upload what is under root_dir now and every video that lands there later, until
+    # stop_event is set or the process is interrupted
+    stop_event = stop_event or threading.Event()
+    pool = _upload_pool(youtube, storage, workers, dedupe, full_hash, quota, bandwidth, chunk_sizes, engine,
+                        service_factory, profiles=profiles)
+    catalogue = PlaylistCatalogue(storage, quota=quota)
+    watcher = DirectoryWatcher(root_dir, settle, poll_interval, use_events)
+    playlist_ids = {}
+    uploads = {}
+    try:
+        watcher.start()
+        print(f"Watching {root_dir} for videos{' (polling)' if watcher.polling else ''}. Press Ctrl+C to stop.")
+        while not stop_event.is_set():
+            ready = schedule_uploads(watcher.ready(), root_dir, schedule, priorities)
+            new_playlists = list(dict.fromkeys(entry[0] for entry in ready if entry[0] not in playlist_ids))
+            if new_playlists:
+                create_playlists(youtube, new_playlists, storage, catalogue, quota, profiles)
+                for playlist_name in new_playlists:
+                    playlist_ids[playlist_name] = create_or_get_playlist(youtube, playlist_name, storage, catalogue,
+                                                                         quota, profiles)
+            for playlist_name, video_path, _, _ in ready:
+                uploads[pool.submit(video_path, playlist_ids[playlist_name])] = (os.path.basename(video_path),
+                                                                                 playlist_name)
+
+            if not uploads:
+                # Idle: queued playlist attachments go out now rather than with a full batch
+                pool.flush_playlists()
+                stop_event.wait(poll_interval)
+                continue
+            done, _ = wait(uploads, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                video, playlist_name = uploads.pop(future)
+                try:
+                    future.result()
+                except QuotaExceededError:
+                    raise
+                except Exception as e:
+                    # One bad file shouldn't stop the watch; it is tried again on the next start
+                    print(f"Failed to upload {video} to playlist {playlist_name}: {e}")
+                    continue
+                print(f"Processed {video} in playlist {playlist_name}")
+    except BaseException:
+        pool.cancel()
+        raise
+    finally:
+        watcher.stop()
+        pool.shutdown()
 
 def main():
     parser = argparse.ArgumentParser(description='Bulk YouTube Video Uploader')
     parser.add_argument('directory', help='Root directory containing videos')
     parser.add_argument('--dry-run', action='store_true', help='Perform a dry run without uploading')
     parser.add_argument('--storage', choices=['sqlite', 'csv'], default='sqlite', help='Storage type for metadata')
+    parser.add_argument('--workers', type=int, default=1, help='Number of videos to upload in parallel')
+    parser.add_argument('--dedupe', choices=['link', 'skip', 'off'], default='link',
+                        help='For files whose content was already uploaded from another path: add the existing '
+                             'video to this playlist (link), just skip them (skip), or upload again (off)')
+    parser.add_argument('--full-hash', action='store_true', help='Also compare a hash of every byte when deduplicating')
+    parser.add_argument('--daily-quota', type=int, default=DAILY_QUOTA, help='API units the project may spend per day')
+    parser.add_argument('--no-wait-for-quota', action='store_true',
+                        help='Stop when the daily quota is used up instead of waiting for it to reset')
+    parser.add_argument('--profiles',
+                        help='JSON file of credential profiles: tokens of several API projects, each with its own '
+                             'daily quota, optionally for other channels by playlist name')
+    parser.add_argument('--bandwidth-limit', type=parse_rate, default=None,
+                        help='Upload rate shared by all workers, in bytes per second (e.g. 500K, 2M)')
+    parser.add_argument('--bandwidth-schedule', type=parse_bandwidth_schedule, default=None,
+                        help='Limits by local time of day, e.g. "08:00=2M,18:00=off"; overrides --bandwidth-limit')
+    parser.add_argument('--min-chunk-mib', type=float, default=CHUNK_SIZE_MIN / 1024 ** 2,
+                        help='Smallest chunk the adaptive chunk size may pick, in MiB')
+    parser.add_argument('--max-chunk-mib', type=float, default=CHUNK_SIZE_MAX / 1024 ** 2,
+                        help='Largest chunk the adaptive chunk size may pick, in MiB')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help='Upload with a thread per worker, or with all workers on one asyncio event loop')
+    parser.add_argument('--metrics-log', help='Append a JSON line per chunk, upload and scan to this file')
+    parser.add_argument('--metrics-file', help='Keep Prometheus metrics in this file, for a textfile collector')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics over HTTP on this port')
+    parser.add_argument('--schedule', choices=sorted(SCHEDULE_POLICIES), default='walk',
+                        help='Upload order: as found (walk), smallest files first (shortest), least recently '
+                             'modified first (oldest), or one video per playlist in turn (round-robin)')
+    parser.add_argument('--priorities',
+                        help='JSON file of playlist or path patterns and priorities; higher goes first '
+                             f'(default: {PRIORITIES_FILE} in the directory, if there is one)')
+    parser.add_argument('--storage-file',
+                        help='Where to keep upload records (default: youtube_uploader_data.sqlite or .csv here)')
+    parser.add_argument('--shared-queue', action='store_true',
+                        help='Share the work with other processes or machines using the same SQLite storage: '
+                             'files are queued in it and each process uploads the ones it claims')
+    parser.add_argument('--sqlite-journal', choices=SQLITE_JOURNAL_MODES, default='wal',
+                        help='SQLite journal mode; use delete when machines share the database over a network '
+                             'filesystem')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and upload new videos as they appear under the directory')
+    parser.add_argument('--settle-seconds', type=float, default=WATCH_SETTLE_SECONDS,
+                        help='With --watch, how long a new file must stay unchanged before it is uploaded')
+    parser.add_argument('--poll-interval', type=float, default=WATCH_POLL_INTERVAL,
+                        help='With --watch, seconds between checks for new files')
+    parser.add_argument('--poll', action='store_true',
+                        help='With --watch, poll the directory even if watchdog is installed')
     args = parser.parse_args()
+    if args.watch and args.dry_run:
+        parser.error('--watch cannot be combined with --dry-run')
+    if args.shared_queue and (args.storage != 'sqlite' or args.watch or args.dry_run):
+        parser.error('--shared-queue needs SQLite storage and cannot be combined with --watch or --dry-run')
+    if args.profiles and args.engine == 'asyncio':
+        parser.error('--profiles needs the threads engine')
+    priorities_file = args.priorities or os.path.join(args.directory, PRIORITIES_FILE)
+    priorities = load_priorities(priorities_file) if args.priorities or os.path.exists(priorities_file) else None
+    metrics.configure(args.metrics_log, args.metrics_file, args.metrics_port)
+    atexit.register(metrics.close)
+    chunk_sizes = (args.min_chunk_mib * 1024 ** 2, args.max_chunk_mib * 1024 ** 2)
 
-    storage_filename = 'youtube_uploader_data.sqlite' if args.storage == 'sqlite' else 'youtube_uploader_data.csv'
-    storage = DataStorage(args.storage, storage_filename)
+    storage_filename = args.storage_file or ('youtube_uploader_data.sqlite' if args.storage == 'sqlite'
+                                             else 'youtube_uploader_data.csv')
+    storage = DataStorage(args.storage, storage_filename, args.sqlite_journal)
+    manifest_filename = os.path.splitext(storage_filename)[0] + '_manifest.json'
 
     if args.dry_run:
         print("Performing dry run...")
-        process_directory(None, args.directory, storage, dry_run=True)
+        process_directory(None, args.directory, storage, dry_run=True, manifest_file=manifest_filename)
     else:
-        youtube = get_authenticated_service()
-        process_directory(youtube, args.directory, storage)
+        profiles = None
+        if args.profiles:
+            profiles = load_profiles(args.profiles, storage, args.daily_quota, not args.no_wait_for_quota)
+            profiles.authenticate()
+            for profile in profiles.profiles:
+                print(f"Quota left today for {profile.name}: {profile.quota.remaining()} of "
+                      f"{profile.quota.daily_limit} units")
+            # Every request goes through one of the profiles
+            youtube, quota = None, None
+        else:
+            youtube = get_authenticated_service()
+            quota = QuotaAccountant(storage, args.daily_quota, wait_for_reset=not args.no_wait_for_quota)
+            print(f"Quota left today: {quota.remaining()} of {quota.daily_limit} units")
+        bandwidth = None
+        if args.bandwidth_limit or args.bandwidth_schedule:
+            bandwidth = BandwidthLimiter(args.bandwidth_limit, args.bandwidth_schedule)
+        if args.watch:
+            try:
+                watch_directory(youtube, args.directory, storage, workers=args.workers, dedupe=args.dedupe,
+                                full_hash=args.full_hash, quota=quota, bandwidth=bandwidth, chunk_sizes=chunk_sizes,
+                                engine=args.engine, settle=args.settle_seconds, poll_interval=args.poll_interval,
+                                use_events=not args.poll, schedule=args.schedule, priorities=priorities,
+                                profiles=profiles)
+            except KeyboardInterrupt:
+                print("Stopped watching.")
+        else:
+            process_directory(youtube, args.directory, storage, workers=args.workers, dedupe=args.dedupe,
+                              full_hash=args.full_hash, manifest_file=manifest_filename, quota=quota,
+                              bandwidth=bandwidth, chunk_sizes=chunk_sizes, engine=args.engine,
+                              schedule=args.schedule, priorities=priorities, job_queue=args.shared_queue,
+                              profiles=profiles)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,59 +1,206 @@
 import sys
 import os
+import threading
 import time
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QPushButton, QVBoxLayout, QHBoxLayout, 
                              QWidget, QFileDialog, QProgressBar, QListWidget, QLabel, QFrame,
-                             QComboBox, QCheckBox, QGroupBox, QRadioButton, QListWidgetItem)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
+                             QComboBox, QCheckBox, QGroupBox, QRadioButton, QListWidgetItem, QSpinBox,
+                             QTableView, QHeaderView, QAbstractItemView)
+from PyQt6.QtCore import Qt, QThread, pyqtSignal, QAbstractTableModel, QModelIndex, QTimer
 from PyQt6.QtGui import QFont
 
-from youtube_uploader import get_authenticated_service, DataStorage, create_or_get_playlist, upload_video, process_directory, QuotaExceededError
-import tkinter as tk
-from tkinter import messagebox
+from concurrent.futures import CancelledError, as_completed
+from youtube_uploader import (get_authenticated_service, DataStorage, create_or_get_playlist, create_playlists,
+                              process_directory, QuotaExceededError, UploadWorkerPool,
+                              PlaylistCatalogue, QuotaAccountant, scan_directory, group_by_playlist)
+from upload_metrics import format_duration, metrics
+
+# How often the window redraws upload progress, in milliseconds
+UI_REFRESH_INTERVAL_MS = 100
+
+class ProgressBoard:
+    # Latest progress of every upload. Upload threads write to it on every
+    # chunk and the window reads it on a timer, so fast uploads don't flood the
+    # event loop with a signal each. It is passed to the upload pool in place
+    # of a signal, which is why progress comes in through emit().
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}     # file_path -> UploadStats, from the upload pool
+        self.progress = {}  # file_path -> progress, changed since the last take()
+        self.statuses = {}  # file_path -> status, changed since the last take()
+        self.workers = {}   # thread name -> (file_path, progress, seconds left) of its current upload
+
+    def emit(self, playlist_id, file_path, progress, remaining_time):
+        with self.lock:
+            self.progress[file_path] = progress
+            self.workers[threading.current_thread().name] = (file_path, progress, remaining_time)
+
+    def set_status(self, file_path, status):
+        with self.lock:
+            self.statuses[file_path] = status
+            self.progress.pop(file_path, None)
+            for worker, (path, _, _) in list(self.workers.items()):
+                if path == file_path:
+                    del self.workers[worker]
+
+    def take(self):
+        # Changes since the last call, the uploads running now and the speed of each
+        with self.lock:
+            progress, self.progress = self.progress, {}
+            statuses, self.statuses = self.statuses, {}
+            workers = dict(self.workers)
+        speeds = {}
+        for path in (*progress, *statuses, *(path for path, _, _ in workers.values())):
+            if path in self.stats:
+                speeds[path] = self.stats[path].throughput()
+        return progress, statuses, workers, speeds
+
+class UploadTableModel(QAbstractTableModel):
+    # Every video of the run, one row each. Rows are plain lists and updates are
+    # announced once per refresh, so the view stays quick with 100k rows.
+    COLUMNS = ('Playlist', 'File', 'Size', 'Status', 'Speed')
+    STATUS_COLUMN = 3
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []       # [playlist, file_path, size, status, bytes per second]
+        self.row_by_path = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        playlist, file_path, size, status, speed = self.rows[index.row()]
+        column = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == 0:
+                return playlist
+            if column == 1:
+                return os.path.basename(file_path)
+            if column == 2:
+                return f"{size / 1024 ** 2:,.1f} MB"
+            if column == 3:
+                return status
+            if column == 4:
+                return f"{speed / 1e6:.1f} MB/s" if speed else ""
+        elif role == Qt.ItemDataRole.ToolTipRole and column == 1:
+            return file_path
+        elif role == Qt.ItemDataRole.TextAlignmentRole and column in (2, 4):
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def set_files(self, files):
+        # files: (playlist, file_path, size) for every video found
+        self.beginResetModel()
+        self.rows = [[playlist, file_path, size, "Queued", None] for playlist, file_path, size in files]
+        self.row_by_path = {row[1]: i for i, row in enumerate(self.rows)}
+        self.endResetModel()
+
+    def update(self, changes):
+        # changes: file_path -> (status, speed); either may be None to keep the current one
+        first = last = None
+        for file_path, (status, speed) in changes.items():
+            i = self.row_by_path.get(file_path)
+            if i is None:
+                continue
+            if status is not None:
+                self.rows[i][3] = status
+            if speed is not None:
+                self.rows[i][4] = speed
+            first = i if first is None else min(first, i)
+            last = i if last is None else max(last, i)
+        if first is not None:
+            self.dataChanged.emit(self.index(first, self.STATUS_COLUMN), self.index(last, len(self.COLUMNS) - 1))
 
 class UploaderThread(QThread):
     update_overall_progress = pyqtSignal(int, int, int)  # progress, total files, processed files
-    update_file_progress = pyqtSignal(str, str, int, float)  # playlist, video, progress, remaining time
+    update_eta = pyqtSignal(float)  # seconds left for the whole run, -1 if unknown
     update_status = pyqtSignal(str)
-    file_completed = pyqtSignal(str, str, str)  # playlist, video, video_id
+    files_found = pyqtSignal(list)  # (playlist, file_path, size) of every video
+    error_reported = pyqtSignal(str, str)  # title, message
 
-    def __init__(self, directory, storage, dry_run=False):
+    def __init__(self, directory, storage, dry_run=False, workers=1, manifest_file=None, wait_for_quota=False):
         super().__init__()
         self.directory = directory
         self.storage = storage
         self.dry_run = dry_run
+        self.workers = workers
+        self.manifest_file = manifest_file
+        self.wait_for_quota = wait_for_quota
+        self.board = ProgressBoard()
         self.is_paused = False
         self.is_cancelled = False
+        self.quota = None
+        self.pool = None
+
+    def cancel(self):
+        # Called from the window. Wakes everything that may be waiting: for the quota
+        # reset, a retry backoff, the bandwidth limit or a free worker.
+        self.is_cancelled = True
+        if self.quota:
+            self.quota.stop()
+        if self.pool:
+            self.pool.cancel()
+
+    def _wait_if_paused(self):
+        while self.is_paused and not self.is_cancelled:
+            time.sleep(0.1)
+        return not self.is_cancelled
 
     def _process_files(self, youtube=None):
-        total_files = sum([len(files) for r, d, files in os.walk(self.directory) if any(f.endswith(('.mp4', '.avi', '.mov', '.mkv', '.m4v')) for f in files)])
+        self.update_status.emit("Scanning directory...")
+        entries = scan_directory(self.directory, self.manifest_file)
+        total_files = len(entries)
+        total_bytes = sum(entry[2] for entry in entries)
+        self.update_status.emit(f"Found {total_files} videos ({total_bytes / 1024 ** 3:.2f} GB)")
         processed_files = 0
-
-        for dirpath, dirnames, filenames in os.walk(self.directory):
-            rel_path = os.path.relpath(dirpath, self.directory)
-            if rel_path == '.':
-                continue
-
-            playlist_name = '_'.join(rel_path.split(os.path.sep))
-            video_files = [f for f in filenames if f.endswith(('.mp4', '.avi', '.mov', '.mkv', '.m4v'))]
-
-            if video_files:
+        pool = None
+        quota = None
+        if not self.dry_run:
+            quota = self.quota = QuotaAccountant(self.storage, wait_for_reset=self.wait_for_quota,
+                                                 on_wait=self.update_status.emit)
+        catalogue = PlaylistCatalogue(self.storage, quota=quota)
+        uploads = {}
+        if not self.dry_run:
+            pool = self.pool = UploadWorkerPool(self.storage, self.workers, update_file_progress=self.board,
+                                                gate=self._wait_if_paused, quota=quota)
+            self.board.stats = pool.stats
+            if self.is_cancelled:
+                pool.cancel()
+
+        playlists = group_by_playlist(entries)
+        self.files_found.emit([(playlist_name, os.path.normpath(video_path), size)
+                               for playlist_name, videos in playlists.items()
+                               for _, video_path, size, _ in videos])
+        stopped, failed = False, 0
+        try:
+            if not self.dry_run:
+                create_playlists(youtube, list(playlists), self.storage, catalogue, quota)
+
+            for playlist_name, videos in playlists.items():
+                if not self._wait_if_paused():
+                    break
                 if self.dry_run:
                     playlist_id = f"DRY_RUN_PLAYLIST_{playlist_name}"
                     self.update_status.emit(f"Dry run: Processing {playlist_name}")
                 else:
-                    playlist_id = create_or_get_playlist(youtube, playlist_name, self.storage)
+                    playlist_id = create_or_get_playlist(youtube, playlist_name, self.storage, catalogue, quota)
                     self.update_status.emit(f"Uploading to {playlist_name}")
 
-                for video in video_files:
-                    while self.is_paused:
-                        time.sleep(0.1)
-                    if self.is_cancelled:
-                        return
-                    video_path = os.path.join(dirpath, video)
+                for _, video_path, size, _ in videos:
+                    if not self._wait_if_paused():
+                        break
                     video_path = os.path.normpath(video_path)
-                    video_title = os.path.splitext(video)[0]
-                    
+                    video_title = os.path.splitext(os.path.basename(video_path))[0]
+
                     if self.dry_run:
                         self.storage.add_dry_run_video(video_title, playlist_id, video_path)
                         for progress in range(0, 101, 10):
@@ -61,34 +208,78 @@ class UploaderThread(QThread):
                                 return
                             time.sleep(0.1)  # Simulate processing time
                             remaining_time = (100 - progress) * 0.1
-                            self.update_file_progress.emit(playlist_name, video_title, progress, remaining_time)
+                            self.board.emit(playlist_id, video_path, progress, remaining_time)
+                        self.board.set_status(video_path, "Dry run")
+                        processed_files += 1
+                        self.update_overall_progress.emit(int((processed_files / total_files) * 100), total_files, processed_files)
                     else:
-                        try:
-                            video_id, video_title, _ = upload_video(youtube, video_path, playlist_id, self.storage, self.update_file_progress)
-                            if video_id:
-                                self.update_status.emit(f"Uploaded: {video_title}")
-                                self.file_completed.emit(playlist_name, video_title, video_id)
-                            else:
-                                self.update_status.emit(f"Failed to upload: {os.path.basename(video_path)}")
-                        except QuotaExceededError as e:
-                            messagebox.showerror("Quota Exceeded", str(e))
-                            self.update_status.emit("Upload process stopped due to exceeded quota.")
-                            break  # Stop the upload process when quota exceeded
-                        except Exception as e:
-                            error_message = f"Error uploading {os.path.basename(video_path)}: {str(e)}"
-                            self.update_status.emit(error_message)
-                            messagebox.showerror("Upload Error", error_message)
-                            if not messagebox.askyesno("Continue Uploading", "An error occurred. Do you want to continue with the next video?"):
-                                break
-
-                    processed_files += 1
-                    self.update_overall_progress.emit(int((processed_files / total_files) * 100), total_files, processed_files)
-
-        if self.dry_run:
+                        uploads[pool.submit(video_path, playlist_id)] = (playlist_name, video_path, size)
+        except BaseException:
+            if pool:
+                pool.cancel()
+            raise
+        finally:
+            # Whatever was submitted is seen through, and the pool shut down, before the storage is closed
+            if pool:
+                stopped, failed = self._collect_uploads(pool, uploads, total_files)
+
+        if stopped:
+            return
+        if self.is_cancelled:
+            self.update_status.emit("Cancelled")
+        elif self.dry_run:
             self.update_status.emit("Dry run completed!")
+        elif failed and failed == len(uploads):
+            self.update_status.emit("Upload failed: no video could be uploaded.")
+        elif failed:
+            self.update_status.emit(f"Upload finished with {failed} of {len(uploads)} videos failed.")
         else:
             self.update_status.emit("Upload completed!")
 
+    def _collect_uploads(self, pool, uploads, total_files):
+        # Updates every upload's row as it ends, including those that end after a
+        # cancel or a quota stop. Returns (stopped by the quota, uploads that failed).
+        processed_files = 0
+        failed = 0
+        stopped = False
+        remaining_bytes = sum(size for _, _, size in uploads.values())
+        try:
+            for future in as_completed(uploads):
+                playlist_name, video_path, size = uploads[future]
+                remaining_bytes -= size
+                try:
+                    video_id, video_title, _ = future.result()
+                    if video_id:
+                        self.board.set_status(video_path, f"Uploaded ({video_id})")
+                    else:
+                        self.board.set_status(video_path, "Cancelled" if self.is_cancelled else "Not uploaded")
+                except CancelledError:
+                    self.board.set_status(video_path, "Cancelled" if self.is_cancelled else "Not uploaded")
+                except QuotaExceededError as e:
+                    if pool.stop_event.is_set():
+                        # Stopped by the cancel or the quota stop below, not by the quota itself
+                        self.board.set_status(video_path, "Cancelled" if self.is_cancelled else "Not uploaded")
+                    else:
+                        # Stop the upload process when quota exceeded; the other uploads are dropped
+                        stopped = True
+                        pool.cancel()
+                        self.board.set_status(video_path, "Quota exceeded")
+                        self.error_reported.emit("Quota Exceeded", str(e))
+                        self.update_status.emit("Upload process stopped due to exceeded quota.")
+                except Exception as e:
+                    # Reported without waiting for anyone; the other uploads carry on
+                    failed += 1
+                    self.board.set_status(video_path, "Error")
+                    self.error_reported.emit("Upload Error", f"Error uploading {os.path.basename(video_path)}: {str(e)}")
+
+                processed_files += 1
+                self.update_overall_progress.emit(int((processed_files / total_files) * 100), total_files, processed_files)
+                eta = metrics.eta(remaining_bytes) if remaining_bytes else 0
+                self.update_eta.emit(-1 if eta is None else eta)
+        finally:
+            pool.shutdown()
+        return stopped, failed
+
     def dry_run_process(self):
         self._process_files()
 
@@ -97,10 +288,21 @@ class UploaderThread(QThread):
         self._process_files(youtube)
 
     def run(self):
-        if self.dry_run:
-            self.dry_run_process()
-        else:
-            self.upload_process()
+        try:
+            if self.dry_run:
+                self.dry_run_process()
+            else:
+                self.upload_process()
+        except QuotaExceededError as e:
+            # Out of quota, or cancelled, while creating playlists
+            if self.is_cancelled:
+                self.update_status.emit("Cancelled")
+            else:
+                self.error_reported.emit("Quota Exceeded", str(e))
+                self.update_status.emit("Upload process stopped due to exceeded quota.")
+        finally:
+            # Each run opens its own storage
+            self.storage.close()
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -136,32 +338,67 @@ class MainWindow(QMainWindow):
         storage_layout.addWidget(self.storage_combo)
         options_layout.addLayout(storage_layout)
 
+        # Parallel uploads
+        workers_layout = QHBoxLayout()
+        workers_label = QLabel("Parallel Uploads:")
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, 16)
+        self.workers_spin.setValue(1)
+        workers_layout.addWidget(workers_label)
+        workers_layout.addWidget(self.workers_spin)
+        options_layout.addLayout(workers_layout)
+
         # Dry run option
         self.dry_run_checkbox = QCheckBox("Dry Run (No actual upload)")
         options_layout.addWidget(self.dry_run_checkbox)
 
+        # Stop when the quota runs out, unless asked to wait for the reset
+        self.wait_quota_checkbox = QCheckBox("Wait for the daily quota to reset when it runs out")
+        options_layout.addWidget(self.wait_quota_checkbox)
+
         options_group.setLayout(options_layout)
         layout.addWidget(options_group)
 
-        # Add Columns: Playlists and Videos
-        self.playlist_list = QListWidget()  # Playlist column
-        self.video_list = QListWidget()     # Video column
-        column_layout = QHBoxLayout()
-        column_layout.addWidget(self.playlist_list)
-        column_layout.addWidget(self.video_list)
-        layout.addLayout(column_layout)
+        # Every video of the run, with its status
+        self.upload_model = UploadTableModel()
+        self.upload_table = QTableView()
+        self.upload_table.setModel(self.upload_model)
+        self.upload_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.upload_table.setWordWrap(False)
+        # Fixed row heights, so the view never measures rows it doesn't show
+        self.upload_table.verticalHeader().setVisible(False)
+        self.upload_table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.upload_table.verticalHeader().setDefaultSectionSize(self.upload_table.fontMetrics().height() + 6)
+        self.upload_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.upload_table)
 
         # Overall Progress
         self.overall_progress_label = QLabel("Overall Progress:")
         layout.addWidget(self.overall_progress_label)
         self.overall_progress_bar = QProgressBar()
         layout.addWidget(self.overall_progress_bar)
-
-        # Current file progress
-        self.current_file_label = QLabel("Current File:")
-        layout.addWidget(self.current_file_label)
-        self.current_file_progress_bar = QProgressBar()
-        layout.addWidget(self.current_file_progress_bar)
+        self.eta_label = QLabel("")
+        layout.addWidget(self.eta_label)
+
+        # One row per upload running at the same time
+        self.workers_group = QGroupBox("Workers")
+        self.workers_layout = QVBoxLayout()
+        self.workers_group.setLayout(self.workers_layout)
+        layout.addWidget(self.workers_group)
+        self.worker_rows = []   # (label, progress bar)
+        self.worker_slots = {}  # thread name -> index in worker_rows
+
+        # Errors wait here instead of stopping the uploads with a dialog
+        errors_layout = QHBoxLayout()
+        self.errors_label = QLabel("Errors: 0")
+        clear_errors_button = QPushButton("Clear Errors")
+        clear_errors_button.clicked.connect(self.clear_errors)
+        errors_layout.addWidget(self.errors_label)
+        errors_layout.addWidget(clear_errors_button)
+        layout.addLayout(errors_layout)
+        self.error_list = QListWidget()
+        self.error_list.setMaximumHeight(100)
+        layout.addWidget(self.error_list)
 
         # Status label
         self.status_label = QLabel("Ready to upload")
@@ -187,6 +424,9 @@ class MainWindow(QMainWindow):
 
         self.directory = None
         self.uploader_thread = None
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(UI_REFRESH_INTERVAL_MS)
+        self.refresh_timer.timeout.connect(self.refresh_progress)
 
     def select_directory(self):
         self.directory = QFileDialog.getExistingDirectory(self, "Select Directory")
@@ -197,15 +437,36 @@ class MainWindow(QMainWindow):
     def _setup_uploader_thread(self, dry_run):
         storage_type = 'sqlite' if self.storage_combo.currentText() == "SQLite" else 'csv'
         storage_filename = 'youtube_uploader_data.sqlite' if storage_type == 'sqlite' else 'youtube_uploader_data.csv'
+        manifest_filename = os.path.splitext(storage_filename)[0] + '_manifest.json'
         self.storage = DataStorage(storage_type, storage_filename)
-        self.uploader_thread = UploaderThread(self.directory, self.storage, dry_run)
+        self.uploader_thread = UploaderThread(self.directory, self.storage, dry_run, self.workers_spin.value(),
+                                              manifest_filename, self.wait_quota_checkbox.isChecked())
         self.uploader_thread.update_overall_progress.connect(self.update_overall_progress)
-        self.uploader_thread.update_file_progress.connect(self.update_file_progress)
+        self.uploader_thread.update_eta.connect(self.update_eta)
         self.uploader_thread.update_status.connect(self.update_status)
-        self.uploader_thread.file_completed.connect(self.file_completed)
+        self.uploader_thread.files_found.connect(self.upload_model.set_files)
+        self.uploader_thread.error_reported.connect(self.report_error)
         self.uploader_thread.finished.connect(self.upload_finished)
+        self._setup_worker_rows(1 if dry_run else self.workers_spin.value())
+        self.refresh_timer.start()
         self.uploader_thread.start()
 
+    def _setup_worker_rows(self, count):
+        while self.workers_layout.count():
+            row = self.workers_layout.takeAt(0).layout()
+            while row.count():
+                row.takeAt(0).widget().deleteLater()
+        self.worker_rows = []
+        self.worker_slots = {}
+        for _ in range(count):
+            row = QHBoxLayout()
+            label = QLabel("Idle")
+            bar = QProgressBar()
+            row.addWidget(label, 2)
+            row.addWidget(bar, 1)
+            self.workers_layout.addLayout(row)
+            self.worker_rows.append((label, bar))
+
     def start_upload(self):
         if not self.directory:
             return
@@ -224,8 +485,8 @@ class MainWindow(QMainWindow):
 
     def cancel_upload(self):
         if self.uploader_thread:
-            self.uploader_thread.is_cancelled = True
-            self.upload_button.setEnabled(True)
+            self.uploader_thread.cancel()
+            self.update_status("Cancelling...")
             self.pause_button.setEnabled(False)
             self.cancel_button.setEnabled(False)
 
@@ -233,26 +494,56 @@ class MainWindow(QMainWindow):
         self.overall_progress_bar.setValue(progress)
         self.overall_progress_label.setText(f"Overall Progress: {processed_files}/{total_files} files")
 
-    def update_file_progress(self, playlist, video, progress, remaining_time):
-        self.current_file_label.setText(f"Uploading {video} from {playlist}: {progress }%")
-        self.current_file_progress_bar.setValue(progress)
-        self.status_label.setText(f"Time left: {remaining_time:.2f}s")
+    def refresh_progress(self):
+        # Runs every UI_REFRESH_INTERVAL_MS, however often the uploads report
+        if not self.uploader_thread:
+            return
+        progress, statuses, workers, speeds = self.uploader_thread.board.take()
+        changes = {path: (f"Uploading {percent}%", speeds.get(path)) for path, percent in progress.items()}
+        changes.update((path, (status, speeds.get(path))) for path, status in statuses.items())
+        self.upload_model.update(changes)
+
+        busy = set()
+        for worker, (path, percent, remaining_time) in workers.items():
+            slot = self.worker_slots.setdefault(worker, len(self.worker_slots))
+            if slot >= len(self.worker_rows):
+                continue
+            busy.add(slot)
+            label, bar = self.worker_rows[slot]
+            speed = speeds.get(path)
+            label.setText(f"{os.path.basename(path)}: {speed / 1e6 if speed else 0:.1f} MB/s, "
+                          f"{format_duration(remaining_time if remaining_time >= 0 else None)} left")
+            bar.setValue(percent)
+        for slot, (label, bar) in enumerate(self.worker_rows):
+            if slot not in busy:
+                label.setText("Idle")
+                bar.setValue(0)
+
+    def update_eta(self, remaining_time):
+        self.eta_label.setText(f"About {format_duration(remaining_time if remaining_time >= 0 else None)} left "
+                               f"at {metrics.rate() / 1e6:.1f} MB/s")
 
     def update_status(self, status):
         self.status_label.setText(status)
 
-    def file_completed(self, playlist, video, video_id):
-        # Adding playlist and video titles to separate columns
-        self.playlist_list.addItem(QListWidgetItem(playlist))
-        self.video_list.addItem(QListWidgetItem(f"{video} (ID: {video_id})"))
+    def report_error(self, title, message):
+        item = QListWidgetItem(f"{title}: {message}")
+        item.setToolTip(message)
+        self.error_list.addItem(item)
+        self.error_list.scrollToBottom()
+        self.errors_label.setText(f"Errors: {self.error_list.count()}")
+
+    def clear_errors(self):
+        self.error_list.clear()
+        self.errors_label.setText("Errors: 0")
 
     def upload_finished(self):
+        self.refresh_timer.stop()
+        self.refresh_progress()
         self.upload_button.setEnabled(True)
         self.pause_button.setEnabled(False)
         self.cancel_button.setEnabled(False)
         self.overall_progress_bar.setValue(100)
-        self.current_file_progress_bar.setValue(100)
-        self.current_file_label.setText("Upload completed")
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)